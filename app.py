@@ -1,93 +1,240 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 import uvicorn
 from read_pdf import PDFReader
 from index import TextIndexing
 from qna import ChatBot
+from jobs import JobQueue
 import os
+import json
+import uuid
 from config import api_key, api_type, api_version, api_base,model,embed_model
+from config import api_workers, chunk_store_path, batch_max_questions
 
-app = FastAPI()
+# Created at startup rather than on import: spawned PDF extraction workers re-import
+# this module when it is run as `python app.py`, and must not build their own
+index = None  # Handles the indexing of text data
+qna = None  # Manages interactions with the chatbot
+ingestion_jobs = None  # Runs uploads in the background, one at a time
 
-# Initialize the indexing and chatbot
-index = TextIndexing(api_key, api_type, api_version, api_base,embed_model)  # This handles the indexing of text data
-qna = ChatBot(api_key, api_type, api_version, api_base,model,embed_model)         # This manages interactions with the chatbot
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Initialize the indexing, chatbot and job queue when the server starts.
+    """
+    global index, qna, ingestion_jobs
+    index = TextIndexing(api_key, api_type, api_version, api_base,embed_model)
+    qna = ChatBot(api_key, api_type, api_version, api_base,model,embed_model)
+    ingestion_jobs = JobQueue(workers=1, path=chunk_store_path)
+    # Convert a legacy index before serving, so searches never read one; a no-op once it is current
+    await run_in_threadpool(index.upgrade_index)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Define a model for the chat messages
 class ChatMessage(BaseModel):
     user_input: str  # The user's input text for the chat
+    session_id: Optional[str] = None  # Conversation to continue; a new one is started if omitted
+    # Optional per-request search settings; server defaults are used when omitted
+    k: Optional[int] = Field(None, gt=0)  # Number of chunks to retrieve
+    min_similarity: Optional[float] = Field(None, ge=-1, le=1)  # Vector hits with a lower cosine similarity are dropped
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None  # Retrieval mode
+    min_bm25: Optional[float] = Field(None, ge=0)  # Lexical hits scoring below this are dropped
+
+    def search_params(self):
+        return self.model_dump(include={"k", "min_similarity", "mode", "min_bm25"}, exclude_none=True)
+
+class BatchChatRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=batch_max_questions)  # Independent questions, each answered without chat history
+    concurrency: Optional[int] = Field(None, gt=0)  # Maximum completion requests in flight
+    k: Optional[int] = Field(None, gt=0)
+    min_similarity: Optional[float] = Field(None, ge=-1, le=1)
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+    min_bm25: Optional[float] = Field(None, ge=0)
+
+    def search_params(self):
+        return self.model_dump(include={"k", "min_similarity", "mode", "min_bm25"}, exclude_none=True)
 
 class UploadResponse(BaseModel):
     message: str
 
 # Define the file paths to be deleted
 INDEX_FILE_PATH = "sample_index.index"
-JSON_FILE_PATH = "sample_data.json"
 
 @app.post("/delete-files")
-async def delete_files():
-    def delete_file(file_path: str):
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                return {"status": "success", "file": file_path}
-            else:
-                return {"status": "error", "file": file_path, "message": "File does not exist"}
-        except Exception as e:
-            return {"status": "error", "file": file_path, "message": str(e)}
-
-    # Delete the predefined files
-    index_result = delete_file(INDEX_FILE_PATH)
-    json_result = delete_file(JSON_FILE_PATH)
+def delete_files():
+    # Delete the index file and empty the chunk store and document registry
+    index_existed = os.path.exists(INDEX_FILE_PATH)
+    try:
+        index.clear()
+        if index_existed:
+            index_result = {"status": "success", "file": INDEX_FILE_PATH}
+        else:
+            index_result = {"status": "error", "file": INDEX_FILE_PATH, "message": "File does not exist"}
+        chunk_result = {"status": "success", "file": index.store.path}
+    except Exception as e:
+        index_result = {"status": "error", "file": INDEX_FILE_PATH, "message": str(e)}
+        chunk_result = {"status": "error", "file": index.store.path, "message": str(e)}
     
     return {
         "index_file": index_result,
-        "json_file": json_result
+        "chunk_store": chunk_result
     }
 
-@app.post("/upload")
+def ingest_pdf(path, filename, progress):
+    """
+    Background ingestion job: extract, chunk, embed and index a spooled PDF, then remove the temporary file.
+    """
+    # Re-uploading a registered name replaces that document instead of duplicating it
+    if index.ingest_file(path, filename, progress=progress, remove=True) != "done":
+        raise RuntimeError("Indexing failed")
+    return {"file": filename}
+
+@app.post("/upload", status_code=202)
 async def upload_file(file: UploadFile = File(...)):
     """
     API Endpoint to upload a PDF file and index its content.
     
     - **file**: The PDF file to be uploaded.
     
-    This endpoint reads the PDF file, extracts the text, and performs indexing. 
-    If indexing is successful, it returns a success message; otherwise, it raises an HTTP 500 error.
+    The file is saved to a temporary location and indexed by a background job,
+    so the request returns immediately with a job id. Poll `/jobs/{job_id}` for
+    the job's stage (extracting, embedding, indexing) and outcome.
     """
     try:
-        pdf_text, message = PDFReader().extract_text_from_pdf(file.file)  # Extract text from the PDF
+        path = await run_in_threadpool(PDFReader().spool, file.file)
+        job_id = ingestion_jobs.submit(ingest_pdf, path, file.filename, name=file.filename)
+        return JSONResponse(status_code=202, content={"message": "File accepted for indexing", "job_id": job_id})
 
-        if message != "done":
-            raise HTTPException(status_code=500, detail="PyPDF failed")
-        # Index the extracted text
-        index_message = index.indexing(pdf_text)
-        if index_message != "done":
-            raise HTTPException(status_code=500, detail="Indexing failed")
-        
-        return JSONResponse(content={"message": "File uploaded and indexed successfully!"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/documents")
+def list_documents():
+    """
+    API Endpoint listing the indexed documents with their registry details.
+    """
+    return index.registry.documents()
 
+@app.delete("/documents/{name}")
+def delete_document(name: str):
+    """
+    API Endpoint removing one document's chunks and vectors, leaving every other document indexed.
+    """
+    message = index.delete_document(name)
+    if message == "missing":
+        raise HTTPException(status_code=404, detail="Document not found")
+    if message != "done":
+        raise HTTPException(status_code=500, detail="Delete failed")
+    return {"message": f"Deleted {name}"}
+
+@app.put("/documents/{name}", status_code=202)
+async def replace_document(name: str, file: UploadFile = File(...)):
+    """
+    API Endpoint replacing a document with a new version of the file.
+
+    The new version is indexed by a background job (see `/jobs/{job_id}`); the
+    old chunks are removed only once it has been indexed.
+    """
+    try:
+        path = await run_in_threadpool(PDFReader().spool, file.file)
+        job_id = ingestion_jobs.submit(ingest_pdf, path, name, name=name)
+        return JSONResponse(status_code=202, content={"message": "File accepted for indexing", "job_id": job_id})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    API Endpoint reporting the status and progress of a background ingestion job.
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.post("/chat")
-async def chat(message: ChatMessage):
+def chat(message: ChatMessage):
     """
     API Endpoint for chatting with the chatbot.
     
-    - **message**: Contains user input text.
+    - **message**: Contains user input text and optionally the session id of the conversation.
     
-    This endpoint takes user input, processes it through the chatbot, and returns the bot's response.
-    If an error occurs during processing, it prints the error.
+    This endpoint takes user input, processes it through the chatbot, and returns the bot's response
+    together with the session id to send with follow-up questions.
+    If an error occurs during processing, it prints the error. It is a plain function so FastAPI
+    runs the blocking search and completion calls in its thread pool, off the event loop.
     """
     try:
         user_input = message.user_input  # Get user input from the request
-        data = qna.get_bot_response(user_input)  # Get chatbot response based on user input
-        return JSONResponse(content={"message": data})
+        session_id = message.session_id or uuid.uuid4().hex
+        data = qna.get_bot_response(user_input, session_id, **message.search_params())  # Get chatbot response based on user input
+        return JSONResponse(content={"message": data, "session_id": session_id})
     except Exception as e:
         print(e)  # Print any exception that occurs during chat processing
 
+@app.post("/chat/batch")
+def chat_batch(request: BatchChatRequest):
+    """
+    API Endpoint answering many independent questions in one call.
+    
+    - **request**: The questions plus optional search settings and completion concurrency.
+    
+    All questions are embedded together and searched with one matrix FAISS search; completions
+    run concurrently. Each result holds either `message` or `error`, in the order of the questions.
+    At most `BATCH_MAX_QUESTIONS` questions are accepted per call.
+    """
+    results = qna.get_bot_responses(request.questions, request.concurrency, **request.search_params())
+    return {"results": results}
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    API Endpoint reporting hit and miss counts of the embedding, question and answer caches.
+    """
+    return {
+        "embedding_cache": index.cache.stats(),
+        "query_cache": qna.search.query_cache.stats(),
+        "answer_cache": qna.answer_cache.stats(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    """
+    API Endpoint exposing per-stage latency histograms and item counters in the Prometheus text format.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/chat/stream")
+def chat_stream(message: ChatMessage):
+    """
+    API Endpoint for chatting with the chatbot, streaming the answer as Server-Sent Events.
+    
+    - **message**: Contains user input text and optionally the session id of the conversation.
+    
+    Each `message` event carries a JSON object with the next piece of the answer in `token`.
+    A final `done` event carries the session id to send with follow-up questions.
+    """
+    session_id = message.session_id or uuid.uuid4().hex
+
+    def events():
+        for token in qna.get_bot_response_stream(message.user_input, session_id, **message.search_params()):
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'session_id': session_id})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Session-Id": session_id},
+    )
+
 # Run the app using Uvicorn
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Several workers need the app as an import string; they share the index through memory-mapped checkpoints
+    uvicorn.run("app:app" if api_workers > 1 else app, host="0.0.0.0", port=8000, workers=api_workers)
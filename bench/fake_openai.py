@@ -0,0 +1,162 @@
+"""
+Local stand-in for the (Azure) OpenAI embedding and chat completion endpoints.
+
+Embeddings are deterministic bag-of-words hash vectors, so texts sharing words
+land close together and every run returns the same vectors. Each endpoint can
+be given a fixed latency to mimic network round trips.
+
+Run standalone with:
+
+    python -m bench.fake_openai --port 8001 --embed-latency 0.05 --chat-latency 0.5
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+def fake_embedding(text, dim=1536):
+    """
+    Return a deterministic, L2-normalized embedding for `text`.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        position = int.from_bytes(digest[:4], "little") % dim
+        vector[position] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+class FakeOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, dim=1536, embed_latency=0.0, chat_latency=0.0, stream_chunks=20):
+        """
+        Initialize the fake server.
+
+        - **port**: Port to listen on; 0 picks a free one (see `url`).
+        - **dim**: Embedding dimension.
+        - **embed_latency**, **chat_latency**: Seconds added to every embedding or completion request.
+        - **stream_chunks**: Number of pieces a streamed completion is split into.
+        """
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.chat_latency = chat_latency
+        self.stream_chunks = stream_chunks
+        self.requests = {"embeddings": 0, "chat": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                path = self.path.split("?")[0]
+                if path.endswith("/embeddings"):
+                    self.embeddings(body)
+                elif path.endswith("/chat/completions"):
+                    self.chat(body)
+                else:
+                    self.send_json(404, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}})
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def embeddings(self, body):
+                server._count("embeddings")
+                time.sleep(server.embed_latency)
+                inputs = body.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                data = [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text, server.dim)}
+                    for i, text in enumerate(inputs)
+                ]
+                tokens = sum(len(text.split()) for text in inputs)
+                self.send_json(200, {
+                    "object": "list",
+                    "data": data,
+                    "model": body.get("model", "fake-embedding"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+
+            def chat(self, body):
+                server._count("chat")
+                time.sleep(server.chat_latency)
+                question = body.get("messages", [{}])[-1].get("content", "")
+                answer = f"Fake answer based on {len(question.split())} words of prompt."
+                if not body.get("stream"):
+                    self.send_json(200, {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake-chat"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                words = answer.split(" ")
+                size = max(1, len(words) // server.stream_chunks)
+                for start in range(0, len(words), size):
+                    piece = " ".join(words[start:start + size]) + " "
+                    chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI embedding and chat APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeOpenAIServer(args.host, args.port, args.dim, args.embed_latency, args.chat_latency)
+    print(f"Fake OpenAI server listening on {fake.url}")
+    fake.httpd.serve_forever()
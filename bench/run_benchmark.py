@@ -0,0 +1,243 @@
+"""
+Offline benchmark of ingestion and query performance.
+
+Drives PDFReader, TextIndexing, Searching and ChatBot against the local fake
+OpenAI server in bench/fake_openai.py, on synthetic PDFs added one after
+another so the corpus grows. After each document it reports extraction and
+ingestion throughput, search and chat latency percentiles, and memory. A
+recall report then compares full-dimension search with reduced-dimension
+indexes, with and without full-precision re-ranking, on the final corpus. The
+results are printed, or written with --output, as JSON so runs can be diffed.
+
+    python -m bench.run_benchmark --sizes 20,100,400 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def make_pdf(path, pages, words_per_page, seed):
+    """
+    Write a synthetic PDF of `pages` pages of pseudo-words with a Zipf-like frequency distribution.
+
+    Returns the words used, so queries can be drawn from the same vocabulary.
+    """
+    import fitz
+
+    rng = random.Random(seed)
+    vocabulary = [f"term{seed}x{i}" for i in range(3000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    document = fitz.open()
+    for page_num in range(pages):
+        words = rng.choices(vocabulary, weights, k=words_per_page)
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 560, 806), f"Synthetic manual page {page_num + 1}\n" + " ".join(words), fontsize=6)
+    document.save(path)
+    document.close()
+    return vocabulary
+
+
+def percentiles(samples):
+    """
+    Return p50/p95/p99 and mean of `samples` in milliseconds.
+    """
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+        "count": len(samples),
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def recall_report(search, query_vectors, k, dims, rerank):
+    """
+    Compare first-pass reductions of the stored vectors against exact full-dimension cosine search.
+
+    For each reduction and dimension in `dims`, a flat index is built over the
+    final corpus. Recall@k against the exact top k is reported for the index's own
+    ranking and for `rerank` times `k` candidates re-scored at full precision,
+    along with the index size and search latency.
+    """
+    import faiss
+    from vector_index import build_index, normalize_rows, resolve_reduction
+
+    ids, vectors = search.store.load_vectors()
+    if vectors is None:
+        return []
+    vectors = normalize_rows(vectors)
+    queries = normalize_rows(query_vectors)
+    k = min(k, len(ids))
+    exact = np.argsort(-(queries @ vectors.T), axis=1, kind="stable")[:, :k]
+    truth = [set(ids[row].tolist()) for row in exact]
+
+    def recall(found):
+        return float(np.mean([len(truth_ids & set(row)) / k for truth_ids, row in zip(truth, found)]))
+
+    report = []
+    modes = [("none", 0)] + [(reduction, dim) for reduction in ("pca", "truncate") for dim in dims]
+    for reduction, dim in modes:
+        if dim and resolve_reduction(vectors.shape[1], dim, reduction, len(ids)) != dim:
+            report.append({"reduction": reduction, "dim": dim, "skipped": "corpus too small to train"})
+            continue
+        index = build_index("flat", vectors.shape[1], vectors, reduced_dim=dim, reduction="pca" if reduction == "none" else reduction)
+        index.add_with_ids(vectors, ids)
+        (_, first_pass), first_pass_s = timed(index.search, queries, k)
+        (_, candidates), candidates_s = timed(index.search, queries, k * rerank)
+        reranked, rerank_s = timed(search.rerank_hits, queries, candidates, k)
+        report.append({
+            "reduction": reduction,
+            "dim": dim or vectors.shape[1],
+            "index_bytes": int(faiss.serialize_index(index).size),
+            f"recall_at_{k}": recall(first_pass),
+            f"recall_at_{k}_reranked": recall([[chunk_id for chunk_id, _ in row] for row in reranked]),
+            "search_ms_per_query": first_pass_s * 1000 / len(queries),
+            "reranked_search_ms_per_query": (candidates_s + rerank_s) * 1000 / len(queries),
+        })
+        print(f"{reduction} {report[-1]['dim']}d: recall@{k} {report[-1][f'recall_at_{k}']:.3f}, "
+              f"re-ranked {report[-1][f'recall_at_{k}_reranked']:.3f}, index {report[-1]['index_bytes']} bytes", file=sys.stderr)
+    return report
+
+
+def run(args):
+    fake = FakeOpenAIServer(dim=args.dim, embed_latency=args.embed_latency, chat_latency=args.chat_latency).start()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pdf-chatbot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # Index, chunk store and caches are created relative to the working directory
+
+    from read_pdf import PDFReader
+    from index import TextIndexing
+    from qna import ChatBot
+
+    credentials = ("fake-key", "azure", "2024-02-01", fake.url)
+    indexer = TextIndexing(*credentials, "fake-embedding")
+    chatbot = ChatBot(*credentials, "fake-chat", "fake-embedding")
+    search = chatbot.search
+    reader = PDFReader()
+    rng = random.Random(0)
+
+    results = []
+    corpus_pages = 0
+    vocabulary = []
+    for doc_num, pages in enumerate(args.sizes):
+        path = os.path.join(workdir, f"synthetic_{doc_num}.pdf")
+        vocabulary += make_pdf(path, pages, args.words_per_page, seed=doc_num)
+
+        page_texts, extraction_s = timed(lambda: list(reader.iter_file_pages(path)))
+        message, ingestion_s = timed(indexer.add_document, os.path.basename(path), page_texts)
+        if message != "done":
+            raise RuntimeError(f"Indexing {path} failed")
+        chunks = len(indexer.store.document_ids(os.path.basename(path)))
+        corpus_pages += pages
+
+        # Fresh questions for every corpus size so the question-embedding cache does not hide the embedding cost
+        search.query_cache.clear()
+        questions = [" ".join(rng.choices(vocabulary[:500], k=8)) for _ in range(args.queries)]
+        query_vectors = search.question_embeddings(questions)
+
+        vector_latency = [timed(search.vector_search, vector, args.k, float("-inf"))[1] for vector in query_vectors]
+        mode_latency = {}
+        for mode in ("vector", "lexical", "hybrid"):
+            search.query_cache.clear()
+            mode_latency[mode] = percentiles([timed(search.retrieve, q, args.k, None, mode)[1] for q in questions])
+
+        chat_latency = [timed(chatbot.get_bot_response, q, None)[1] for q in questions[:args.chat_queries]]
+
+        indexer.checkpoint()  # Uploads only log their vectors; write the index so its size can be measured
+        index_bytes = os.path.getsize(indexer.index_path) if os.path.exists(indexer.index_path) else 0
+        results.append({
+            "document_pages": pages,
+            "document_chunks": chunks,
+            "corpus_pages": corpus_pages,
+            "corpus_chunks": len(indexer.store),
+            "extraction_s": extraction_s,
+            "pages_per_s": pages / extraction_s if extraction_s else None,
+            "ingestion_s": ingestion_s,
+            "chunks_per_s": chunks / ingestion_s if ingestion_s else None,
+            "vector_search": percentiles(vector_latency),
+            "search": mode_latency,
+            "chat": percentiles(chat_latency),
+            "index_bytes": index_bytes,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        })
+        print(f"{corpus_pages} pages: {results[-1]['pages_per_s']:.1f} pages/s extracted, "
+              f"{results[-1]['chunks_per_s']:.1f} chunks/s indexed, "
+              f"vector search p95 {results[-1]['vector_search']['p95_ms']:.2f} ms", file=sys.stderr)
+
+    recall = recall_report(search, query_vectors, args.k, args.recall_dims, args.rerank)
+    fake.stop()
+    return {
+        "config": {
+            "sizes": args.sizes,
+            "words_per_page": args.words_per_page,
+            "queries": args.queries,
+            "chat_queries": args.chat_queries,
+            "k": args.k,
+            "dim": args.dim,
+            "recall_dims": args.recall_dims,
+            "rerank": args.rerank,
+            "embed_latency_s": args.embed_latency,
+            "chat_latency_s": args.chat_latency,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "fake_server_requests": fake.requests,
+        "results": results,
+        "recall": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmark")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[20, 100, 400],
+                        help="Pages of each synthetic PDF, added one after another")
+    parser.add_argument("--words-per-page", type=int, default=350)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chat-queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--recall-dims", type=lambda value: [int(dim) for dim in value.split(",")], default=[384, 192],
+                        help="Reduced index dimensions compared in the recall report")
+    parser.add_argument("--rerank", type=int, default=4, help="Candidates re-ranked in the recall report, as a multiple of k")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds added to every embedding request")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Seconds added to every completion request")
+    parser.add_argument("--workdir", help="Directory for the index and stores (default: a new temporary directory)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
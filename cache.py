@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """
+    Normalize a question for use as a cache key: lowercase with whitespace collapsed.
+    """
+    return " ".join(text.lower().split())
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        """
+        Initialize a thread-safe in-memory LRU cache whose entries expire after `ttl` seconds.
+
+        - **maxsize**: Maximum number of entries; the least recently used are evicted beyond this.
+        - **ttl**: Lifetime of an entry in seconds. A ttl of 0 or less disables the cache.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under `key`, or `default` if it is missing or expired.
+        """
+        if not self.enabled:
+            return default
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Cache `value` under `key`, evicting the least recently used entry if the cache is full.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Return hit/miss counters and the current number of entries.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._data),
+                "max_entries": self.maxsize,
+            }
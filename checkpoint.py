@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import faiss
+from vector_index import build_index, index_ids, normalize_rows, remove_ids
+
+
+def read_generation(index_path):
+    """
+    Return the generation of the index at `index_path`, or None if there is none.
+
+    The generation is a counter the writer bumps after each checkpoint, so a
+    process only has to read this small file to know whether to reload the
+    index. Indexes written before the counter existed use their modification time.
+    """
+    try:
+        with open(index_path + ".gen") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        pass
+    try:
+        return os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def bump_generation(index_path):
+    """
+    Advance the generation counter of the index at `index_path`. Call with the write lock held.
+    """
+    generation = read_generation(index_path) if os.path.exists(index_path + ".gen") else 0
+    tmp_path = index_path + ".gen.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str((generation or 0) + 1))
+    os.replace(tmp_path, index_path + ".gen")
+
+
+def replay(indexer, store, after_seq, rebuild=None):
+    """
+    Apply the index changes logged in `store` after `after_seq` to `indexer`, in place.
+
+    Replay is idempotent: ids the index already holds are not added again and
+    ids it lacks are not removed, so replaying from a checkpoint older than the
+    index file is safe.
+
+    - **rebuild**: Callable returning a fresh index built from the store, used when the
+      index cannot remove vectors in place (any type but flat). Without it such deletes are left for the
+      next checkpoint; lookups skip their chunks in the meantime because the store no longer has them.
+
+    Returns (indexer, seq) where `seq` is the last change applied.
+    """
+    ops = store.log_since(after_seq)
+    if not ops:
+        return indexer, after_seq
+    final = {}
+    for _, op, chunk_id in ops:
+        final[chunk_id] = op  # Ids are never reused, so the last operation decides
+    candidates = np.fromiter(final, dtype=np.int64, count=len(final))
+    present = dict(zip(candidates.tolist(), np.isin(candidates, index_ids(indexer)).tolist()))
+
+    deletes = [chunk_id for chunk_id, op in final.items() if op == "delete" and present[chunk_id]]
+    adds = [chunk_id for chunk_id, op in final.items() if op == "add" and not present[chunk_id]]
+    if deletes and not remove_ids(indexer, deletes) and rebuild is not None:
+        # The rebuilt index holds everything in the store, including the additions below
+        return rebuild(), ops[-1][0]
+    ids, vectors = store.get_vectors(adds)
+    if len(ids):
+        indexer.add_with_ids(normalize_rows(vectors), ids)
+    return indexer, ops[-1][0]
+
+
+class LoggedIndex:
+    def __init__(self, base, seq, delta=None, deleted=frozenset()):
+        """
+        A read-only checkpoint index plus the changes logged after it, for processes that only search.
+
+        The checkpoint (`base`) may be memory-mapped and shared with other
+        processes, so it is never modified. Vectors added since are kept in a small
+        in-memory flat index (`delta`), which always holds full vectors even when the
+        checkpoint is reduced, and deleted ids are filtered out of the results; both
+        are emptied by the next checkpoint. The checkpoint must be an id-mapped
+        inner-product index, as every checkpoint the writer takes is.
+
+        - **seq**: Last logged change included.
+        """
+        self.base = base
+        self.seq = seq
+        self.delta = delta
+        self.deleted = deleted
+        self.d = base.d
+
+    @property
+    def ntotal(self):
+        return self.base.ntotal - len(self.deleted) + (self.delta.ntotal if self.delta is not None else 0)
+
+    def apply(self, store):
+        """
+        Return a new LoggedIndex with the changes logged after `seq` applied.
+
+        This object is left untouched, so queries already using it are unaffected
+        and the caller can swap the new one in atomically.
+        """
+        ops = store.log_since(self.seq)
+        if not ops:
+            return self
+        final = {}
+        for _, op, chunk_id in ops:
+            final[chunk_id] = op
+        candidates = np.fromiter(final, dtype=np.int64, count=len(final))
+        in_base = np.isin(candidates, index_ids(self.base))
+        in_delta = np.isin(candidates, index_ids(self.delta)) if self.delta is not None else np.zeros(len(candidates), bool)
+
+        deleted = set(self.deleted)
+        removed, added = [], []
+        for chunk_id, base_has, delta_has in zip(candidates.tolist(), in_base.tolist(), in_delta.tolist()):
+            if final[chunk_id] == "delete":
+                if base_has:
+                    deleted.add(chunk_id)
+                if delta_has:
+                    removed.append(chunk_id)
+            elif not base_has and not delta_has:
+                added.append(chunk_id)
+
+        if self.delta is not None:
+            delta = faiss.clone_index(self.delta)
+        else:
+            delta = build_index("flat", self.d)
+        if removed:
+            remove_ids(delta, removed)
+        ids, vectors = store.get_vectors(added)
+        if len(ids):
+            delta.add_with_ids(normalize_rows(vectors), ids)
+        return LoggedIndex(self.base, ops[-1][0], delta, frozenset(deleted))
+
+    def search(self, queries, k):
+        """
+        Search the checkpoint and the delta and merge them, with the same (distances, ids) result as a FAISS index.
+        """
+        distances, indices = self.base.search(queries, k + len(self.deleted))
+        if self.deleted:
+            dropped = np.isin(indices, np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+            distances[dropped] = -np.inf
+            indices[dropped] = -1
+        if self.delta is not None and self.delta.ntotal:
+            delta_distances, delta_indices = self.delta.search(queries, k)
+            distances = np.hstack([distances, delta_distances])
+            indices = np.hstack([indices, delta_indices])
+        distances[indices < 0] = -np.inf
+        order = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
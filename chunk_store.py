@@ -0,0 +1,494 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import nullcontext
+import numpy as np
+from config import chunk_store_mmap_mb
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can do does for from how i in is it me my of on or so that the this "
+    "to was we what when where which who why will with you your".split()
+)
+
+class ChunkStore:
+    def __init__(self, path="sample_chunks.db", legacy_json_path=None, read_only=False, write_lock=None):
+        """
+        Open (or create) the SQLite chunk store.
+
+        Chunks are stored under the same integer id as their vector in the FAISS
+        index, so a search hit is resolved with a single primary-key lookup. Ids
+        are never reused, so deleting a document leaves other ids stable.
+
+        - **path**: SQLite file the chunks are stored in.
+        - **legacy_json_path**: Old `sample_data.json` file to import once if the store is empty.
+        - **read_only**: Refuse writes on this connection, for processes that only search.
+        - **write_lock**: Lock the import is made under (the indexer's `ProcessLock`), so
+          worker processes starting together import the JSON file only once.
+
+        The database file is memory-mapped (`CHUNK_STORE_MMAP_MB`), so processes
+        reading the same store share its pages through the OS page cache.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Write-ahead journal: a commit is a sequential append, and readers in other connections never block on it
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={chunk_store_mmap_mb * 1024 * 1024}")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                text TEXT NOT NULL,
+                source TEXT,
+                page INTEGER,
+                chunk INTEGER
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        # Full-precision vectors, kept so the FAISS index can be retrained and rebuilt
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (id INTEGER PRIMARY KEY, vector BLOB NOT NULL)")
+        # BM25 inverted index over the chunk text, kept in step with the chunks table
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        # Every vector added or deleted since the last index checkpoint, replayed onto the index file when it is loaded
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS log (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, id INTEGER NOT NULL)"
+        )
+        # Pages of an unfinished upload already committed, so a retry of the same file can resume after them
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS ingest_progress (
+                source TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_page INTEGER NOT NULL,
+                chunks INTEGER NOT NULL
+            )"""
+        )
+        # Dedup fingerprints of every chunk: normalized text hash, MinHash signature and its LSH band buckets
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_hashes (id INTEGER PRIMARY KEY, text_hash TEXT NOT NULL, minhash BLOB)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunk_hashes_text_hash ON chunk_hashes (text_hash)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lsh_buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, id INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_bucket ON lsh_buckets (band, bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_id ON lsh_buckets (id)")
+        # Duplicate chunks skipped at ingest: the document and page they appeared in, and the stored chunk with
+        # their text. `since_id` is the first chunk id allocated by the upload that found them.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_refs (id INTEGER NOT NULL, source TEXT, page INTEGER, since_id INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunk_refs_id ON chunk_refs (id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunk_refs_source ON chunk_refs (source)")
+        if self._conn.execute("SELECT NOT EXISTS (SELECT 1 FROM chunks_fts) AND EXISTS (SELECT 1 FROM chunks)").fetchone()[0]:
+            # Stores created before the lexical index existed
+            self._conn.execute("INSERT INTO chunks_fts (rowid, text) SELECT id, text FROM chunks")
+        self._conn.commit()
+        if read_only:
+            self._conn.execute("PRAGMA query_only=ON")
+        elif legacy_json_path:
+            with write_lock or nullcontext():
+                self.migrate_from_json(legacy_json_path)
+
+    def migrate_from_json(self, json_path):
+        """
+        Import chunks from the old JSON list format, keeping list positions as ids.
+
+        Runs only when the store is empty; the JSON file is renamed afterwards so
+        the import happens once. Call with the write lock held, so the check
+        sees any import another process finished meanwhile.
+        """
+        if not os.path.exists(json_path) or len(self) > 0:
+            return 0
+        with open(json_path, 'r') as file:
+            paragraphs = json.load(file)
+        self.append([{"text": text} for text in paragraphs], start_id=0)
+        os.replace(json_path, json_path + ".migrated")
+        print(f"Migrated {len(paragraphs)} chunks from {json_path}")
+        return len(paragraphs)
+
+    def _next_id(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        if row is not None:
+            return row[0]
+        return self._conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM chunks").fetchone()[0]
+
+    def next_id(self):
+        """
+        Return the id the next appended chunk will get.
+        """
+        with self._lock:
+            return self._next_id()
+
+    def append(self, records, start_id=None, vectors=None, progress=None, refs=None):
+        """
+        Append chunk records under consecutive ids and return the ids assigned.
+
+        - **records**: Dicts with a `text` key and optional `source`, `page` and `chunk` metadata.
+        - **start_id**: Id of the first record; by default the next unused id is allocated.
+        - **vectors**: Optional array of the records' embeddings, stored alongside them
+          and logged as additions to the FAISS index.
+        - **progress**: Optional dict with the `source`, `sha256` and `last_page` of an upload
+          in progress, recorded so a retry can resume after `last_page`, and the number of
+          `chunks` the batch covered (the records appended by default).
+        - **refs**: Optional (target, source, page) tuples recording duplicate chunks that were
+          skipped. `target` is the id of the stored chunk with their text, or the record in
+          `records` they repeat.
+
+        Records carrying dedup fingerprint fields (`text_hash`, and optionally `minhash`
+        and `buckets`, see `dedup.Deduplicator.fingerprint`) have them stored too.
+
+        Everything is committed in one transaction.
+        """
+        if start_id is None:
+            with self._lock:
+                start_id = self._next_id()
+        rows = [
+            (start_id + i, record["text"], record.get("source"), record.get("page"), record.get("chunk"))
+            for i, record in enumerate(records)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM chunks_fts WHERE rowid = ?", [(row[0],) for row in rows])
+            self._conn.executemany("INSERT INTO chunks_fts (rowid, text) VALUES (?, ?)", [(row[0], row[1]) for row in rows])
+            if vectors is not None:
+                self._put_vectors(range(start_id, start_id + len(rows)), vectors)
+                self._conn.executemany("INSERT INTO log (op, id) VALUES ('add', ?)", [(row[0],) for row in rows])
+            self._put_fingerprints(
+                (start_id + i, record) for i, record in enumerate(records) if "text_hash" in record
+            )
+            if refs:
+                positions = {id(record): i for i, record in enumerate(records)}
+                self._conn.executemany(
+                    "INSERT INTO chunk_refs VALUES (?, ?, ?, ?)",
+                    [
+                        (target if isinstance(target, int) else start_id + positions[id(target)], source, page, start_id)
+                        for target, source, page in refs
+                    ],
+                )
+            if progress is not None:
+                self._conn.execute(
+                    """INSERT INTO ingest_progress VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (source) DO UPDATE SET last_page = excluded.last_page, chunks = chunks + excluded.chunks""",
+                    (progress["source"], progress["sha256"], start_id, progress["last_page"], progress.get("chunks", len(rows))),
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('next_id', ?)", (max(self._next_id(), start_id + len(rows)),)
+            )
+            self._conn.commit()
+        return list(range(start_id, start_id + len(rows)))
+
+    def _put_vectors(self, ids, vectors):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO vectors VALUES (?, ?)",
+            [(int(chunk_id), np.asarray(vector, dtype=np.float32).tobytes()) for chunk_id, vector in zip(ids, vectors)],
+        )
+
+    def _put_fingerprints(self, items):
+        for chunk_id, fields in items:
+            self._conn.execute("DELETE FROM lsh_buckets WHERE id = ?", (chunk_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunk_hashes VALUES (?, ?, ?)", (chunk_id, fields["text_hash"], fields.get("minhash"))
+            )
+            self._conn.executemany(
+                "INSERT INTO lsh_buckets VALUES (?, ?, ?)",
+                [(band, bucket, chunk_id) for band, bucket in enumerate(fields.get("buckets", ()))],
+            )
+
+    def put_fingerprints(self, items):
+        """
+        Store dedup fingerprints for existing chunks, given (id, fields) pairs.
+        """
+        with self._lock:
+            self._put_fingerprints(items)
+            self._conn.commit()
+
+    def unfingerprinted(self, limit, minhash=False):
+        """
+        Return up to `limit` (id, text) pairs of chunks without a dedup fingerprint
+        (or, with `minhash`, without a MinHash signature).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT id, text FROM chunks WHERE id NOT IN
+                (SELECT id FROM chunk_hashes WHERE NOT ? OR minhash IS NOT NULL) LIMIT ?""",
+                (minhash, limit),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def find_text_hash(self, text_hash):
+        """
+        Return the ids of chunks whose normalized text has this hash, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM chunk_hashes WHERE text_hash = ? ORDER BY id", (text_hash,)).fetchall()
+        return [row[0] for row in rows]
+
+    def lsh_candidates(self, buckets):
+        """
+        Return the ids of chunks sharing at least one LSH band bucket with `buckets` (one bucket per band).
+        """
+        if not buckets:
+            return []
+        clause = " OR ".join("(band = ? AND bucket = ?)" for _ in buckets)
+        params = [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+        with self._lock:
+            rows = self._conn.execute(f"SELECT DISTINCT id FROM lsh_buckets WHERE {clause}", params).fetchall()
+        return [row[0] for row in rows]
+
+    def minhashes(self, ids):
+        """
+        Return the MinHash signatures of the given chunk ids as {id: uint32 array}.
+        """
+        ids = [int(chunk_id) for chunk_id in ids]
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, minhash FROM chunk_hashes WHERE minhash IS NOT NULL AND id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        return {row[0]: np.frombuffer(row[1], dtype=np.uint32) for row in rows}
+
+    def ref_count(self, source):
+        """
+        Return how many duplicate chunks of the document `source` were skipped in favour of stored ones.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunk_refs WHERE source = ?", (source,)).fetchone()[0]
+
+    def drop_refs(self, source, since_id=None, before_id=None):
+        """
+        Forget the skipped duplicates of `source`, optionally only those recorded by uploads
+        that started at or after `since_id`, or before `before_id`.
+        """
+        with self._lock:
+            self._conn.execute(
+                """DELETE FROM chunk_refs WHERE source = ?
+                AND (? IS NULL OR since_id >= ?) AND (? IS NULL OR since_id < ?)""",
+                (source, since_id, since_id, before_id, before_id),
+            )
+            self._conn.commit()
+
+    def hand_over(self, ids, source):
+        """
+        Reassign chunks of the document `source` that other documents' skipped duplicates
+        point to, so deleting `source` keeps their text searchable.
+
+        A chunk whose exact text is also stored under an id not being removed (e.g. in
+        a new version of `source`) has the duplicates pointed there instead. Otherwise
+        it takes the source and page of its oldest duplicate from another document,
+        whose skip record is dropped. Returns the set of ids reassigned.
+        """
+        ids = [int(chunk_id) for chunk_id in ids]
+        removing = set(ids)
+        handed = set()
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"""SELECT rowid, id, source, page FROM chunk_refs
+                    WHERE source IS NOT ? AND id IN ({','.join('?' * len(part))}) ORDER BY rowid""",
+                    [source] + part,
+                ).fetchall()
+                for rowid, chunk_id, ref_source, page in rows:
+                    if chunk_id in handed:
+                        continue
+                    copies = self._conn.execute(
+                        """SELECT other.id FROM chunk_hashes AS this JOIN chunk_hashes AS other
+                        ON other.text_hash = this.text_hash WHERE this.id = ? ORDER BY other.id""",
+                        (chunk_id,),
+                    ).fetchall()
+                    copy = next((row[0] for row in copies if row[0] not in removing), None)
+                    if copy is not None:
+                        self._conn.execute("UPDATE chunk_refs SET id = ? WHERE id = ?", (copy, chunk_id))
+                        continue
+                    self._conn.execute("UPDATE chunks SET source = ?, page = ? WHERE id = ?", (ref_source, page, chunk_id))
+                    self._conn.execute("DELETE FROM chunk_refs WHERE rowid = ?", (rowid,))
+                    handed.add(chunk_id)
+            self._conn.commit()
+        return handed
+
+    def put_vectors(self, ids, vectors):
+        """
+        Store embeddings for existing chunk ids.
+        """
+        with self._lock:
+            self._put_vectors(ids, vectors)
+            self._conn.commit()
+
+    def vector_count(self):
+        """
+        Return the number of stored vectors.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def load_vectors(self):
+        """
+        Return all stored vectors as (ids, float32 matrix), ordered by id.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, vector FROM vectors ORDER BY id").fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), None
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        return ids, vectors
+
+    def get_vectors(self, ids):
+        """
+        Return (ids, float32 matrix) for the given ids that have a stored vector, in the same order.
+        """
+        ids = [int(chunk_id) for chunk_id in ids]
+        found = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, vector FROM vectors WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update((row[0], np.frombuffer(row[1], dtype=np.float32)) for row in rows)
+        ids = [chunk_id for chunk_id in ids if chunk_id in found]
+        if not ids:
+            return np.empty(0, dtype=np.int64), None
+        return np.array(ids, dtype=np.int64), np.vstack([found[chunk_id] for chunk_id in ids])
+
+    def last_seq(self):
+        """
+        Return the sequence number of the latest logged index change, or 0 if nothing was ever logged.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'log'").fetchone()
+        return row[0] if row else 0
+
+    def log_since(self, seq):
+        """
+        Return the logged index changes after `seq` as (seq, op, id) tuples in order; `op` is "add" or "delete".
+        """
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute("SELECT seq, op, id FROM log WHERE seq > ? ORDER BY seq", (seq,))]
+
+    def checkpoint_seq(self):
+        """
+        Return the sequence number the index file on disk is known to include, 0 if none.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'checkpoint_seq'").fetchone()
+        return row[0] if row else 0
+
+    def mark_checkpoint(self, seq):
+        """
+        Record that the index file now includes every change up to `seq` and trim the log.
+
+        Entries up to the previous checkpoint are dropped rather than those up to
+        `seq`, so a reader that loaded the previous index file can still catch up.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'checkpoint_seq'").fetchone()
+            self._conn.execute("DELETE FROM log WHERE seq <= ?", (row[0] if row else 0,))
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('checkpoint_seq', ?)", (seq,))
+            self._conn.commit()
+
+    def get(self, chunk_id):
+        """
+        Return the record stored under `chunk_id`, or None.
+        """
+        return self.get_many([chunk_id])[0]
+
+    def get_many(self, ids):
+        """
+        Return the records for the given ids, in the same order, with None for unknown ids.
+        """
+        ids = [int(chunk_id) for chunk_id in ids]
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, text, source, page, chunk FROM chunks WHERE id IN ({','.join('?' * len(ids))})",
+                ids,
+            ).fetchall()
+        found = {row["id"]: dict(row) for row in rows}
+        return [found.get(chunk_id) for chunk_id in ids]
+
+    def lexical_search(self, query, k=10):
+        """
+        Rank chunks against `query` with BM25 over the full-text index.
+
+        Returns up to `k` (id, score) pairs, best first; higher scores are better.
+        Stop words are ignored and any remaining query term may match.
+        """
+        terms = [term for term in re.findall(r"\w+", query.lower()) if term not in STOP_WORDS]
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, k),
+            ).fetchall()
+        # SQLite's bm25() is negative, with lower meaning more relevant
+        return [(row[0], -row[1]) for row in rows]
+
+    def ingest_progress(self, source):
+        """
+        Return the checkpoint of an unfinished upload of `source` as a dict with
+        `sha256`, `first_id` (its first chunk id), `last_page` and `chunks`, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, first_id, last_page, chunks FROM ingest_progress WHERE source = ?", (source,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def clear_ingest_progress(self, source):
+        """
+        Forget the upload checkpoint of `source`, once the upload finished or was abandoned.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM ingest_progress WHERE source = ?", (source,))
+            self._conn.commit()
+
+    def document_ids(self, source):
+        """
+        Return the ids of every chunk that came from the document `source`.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM chunks WHERE source = ? ORDER BY id", (source,)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_ids(self, ids):
+        """
+        Delete the chunks, vectors, lexical index entries and dedup records stored under the given ids, logging the deletes.
+        """
+        rows = [(int(chunk_id),) for chunk_id in ids]
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", rows)
+            self._conn.executemany("DELETE FROM chunk_hashes WHERE id = ?", rows)
+            self._conn.executemany("DELETE FROM lsh_buckets WHERE id = ?", rows)
+            self._conn.executemany("DELETE FROM chunk_refs WHERE id = ?", rows)
+            self._conn.executemany("DELETE FROM vectors WHERE id = ?", rows)
+            self._conn.executemany("DELETE FROM chunks_fts WHERE rowid = ?", rows)
+            self._conn.executemany("INSERT INTO log (op, id) VALUES ('delete', ?)", rows)
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Remove every chunk from the store.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM vectors")
+            self._conn.execute("DELETE FROM chunks_fts")
+            self._conn.execute("DELETE FROM log")
+            self._conn.execute("DELETE FROM ingest_progress")
+            self._conn.execute("DELETE FROM chunk_hashes")
+            self._conn.execute("DELETE FROM lsh_buckets")
+            self._conn.execute("DELETE FROM chunk_refs")
+            self._conn.execute("DELETE FROM meta WHERE key IN ('next_id', 'checkpoint_seq')")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
@@ -0,0 +1,115 @@
+import queue
+import threading
+from tokens import count_tokens
+
+
+def numbered_pages(pages):
+    """
+    Yield (page_number, text) pairs from page texts numbered from 1, or from pairs already numbered.
+    """
+    for page_num, page in enumerate(pages, 1):
+        if isinstance(page, tuple):
+            page_num, page = page
+        yield page_num, page
+
+
+def chunk_pages(pages, max_tokens=400, overlap_tokens=50, first_chunk=0):
+    """
+    Split a stream of pages into token-bounded, overlapping chunks.
+
+    - **pages**: Iterable of page texts, or of (page_number, text) pairs.
+    - **max_tokens**: Upper bound on the tokens in one chunk.
+    - **overlap_tokens**: Tokens repeated from the end of one chunk at the start of the next chunk of the same page.
+    - **first_chunk**: Number given to the first chunk, when continuing an interrupted upload.
+
+    Yields dicts with the chunk `text`, the `page` it is on and its `chunk`
+    number. Layout whitespace is collapsed. Chunks never span pages: chunking
+    restarts at every page, so an edit only moves the chunk boundaries of its
+    own page and the chunks of every other page keep their text (and their
+    cached embeddings). Pages are consumed lazily, so chunks are produced while
+    extraction is still running.
+    """
+    words = []  # (word, token count, page number) of the chunk being built
+    tokens = 0
+    fresh = 0  # Words not already carried over from the previous chunk
+    chunk_num = first_chunk
+
+    def emit():
+        return {"text": " ".join(word for word, _, _ in words), "page": words[0][2], "chunk": chunk_num}
+
+    for page_num, page in numbered_pages(pages):
+        for word in page.split():
+            word_tokens = count_tokens(" " + word)
+            if words and tokens + word_tokens > max_tokens:
+                yield emit()
+                chunk_num += 1
+                # Carry the tail of the chunk over as the start of the next one
+                kept, kept_tokens = [], 0
+                for item in reversed(words):
+                    if kept_tokens + item[1] > overlap_tokens:
+                        break
+                    kept.append(item)
+                    kept_tokens += item[1]
+                words, tokens, fresh = kept[::-1], kept_tokens, 0
+            words.append((word, word_tokens, page_num))
+            tokens += word_tokens
+            fresh += 1
+        if fresh:
+            yield emit()
+            chunk_num += 1
+        words, tokens, fresh = [], 0, 0
+
+
+def batched_by_page(chunks, size):
+    """
+    Yield lists of at least `size` consecutive chunks (fewer only for the last one),
+    cut only where the next chunk starts on a later page.
+
+    Every chunk starting on a page is then in the same or an earlier batch than
+    the batch ending on that page, so a committed batch marks its last page as done.
+    """
+    batch = []
+    for chunk in chunks:
+        if len(batch) >= size and chunk["page"] > batch[-1]["page"]:
+            yield batch
+            batch = []
+        batch.append(chunk)
+    if batch:
+        yield batch
+
+
+def prefetch(iterable, size=64):
+    """
+    Run `iterable` in a background thread, buffering up to `size` items ahead of the consumer.
+
+    Lets PDF extraction and chunking carry on while the consumer waits on embedding requests.
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                buffer.put((item, None))
+            buffer.put((done, None))
+        except Exception as e:
+            buffer.put((done, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full buffer
+        while not buffer.empty():
+            buffer.get_nowait()
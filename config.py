@@ -7,4 +7,83 @@ api_type = os.getenv("API_TYPE")
 api_base = os.getenv("API_BASE")
 api_version = os.getenv("API_VERSION")
 model = os.getenv("MODEL")
-embed_model= os.getenv('EMBED_MODEL')
\ No newline at end of file
+embed_model= os.getenv('EMBED_MODEL')
+
+# Embeddings: openai (the EMBED_MODEL deployment) or local (a sentence-transformers model run on this machine)
+embed_provider = os.getenv("EMBED_PROVIDER", "openai")
+local_embed_model = os.getenv("LOCAL_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+local_embed_device = os.getenv("LOCAL_EMBED_DEVICE", "cpu")
+embed_dimensions = int(os.getenv("EMBED_DIMENSIONS", 0))  # Shortened OpenAI embeddings (text-embedding-3 models); 0 keeps the full size
+
+# Outbound OpenAI requests, limited per model or deployment. OPENAI_TOKENS_PER_MINUTE is the deployment's quota
+# (0 for no limit); uploads leave OPENAI_INTERACTIVE_RESERVE of the request slots and token rate free for chat
+openai_max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+openai_tokens_per_minute = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 0))
+openai_interactive_reserve = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", 0.25))
+openai_max_retries = int(os.getenv("OPENAI_MAX_RETRIES", 6))
+
+# Ingestion tuning
+embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", 16))
+embed_concurrency = int(os.getenv("EMBED_CONCURRENCY", 4))
+embed_max_retries = int(os.getenv("EMBED_MAX_RETRIES", 6))
+chunk_max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", 400))
+chunk_overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", 50))
+ingest_batch_chunks = int(os.getenv("INGEST_BATCH_CHUNKS", 64))
+pdf_workers = int(os.getenv("PDF_WORKERS", 0))  # 0 uses every CPU core
+pdf_pages_per_task = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+pdf_parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))
+# Duplicate chunks are skipped before embedding: off, exact (same normalized text) or near (also MinHash/LSH
+# matches whose word shingles overlap by at least DEDUP_THRESHOLD). Near matches are skipped even though their
+# text differs, so the changes in a revised document would never be indexed; only opt in for corpora of copies
+dedup_mode = os.getenv("DEDUP_MODE", "exact")
+dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", 0.85))
+embed_cache_path = os.getenv("EMBED_CACHE_PATH", "embedding_cache.db")
+embed_cache_max_entries = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 100000))
+
+# Storage
+chunk_store_path = os.getenv("CHUNK_STORE_PATH", "sample_chunks.db")
+chunk_store_mmap_mb = int(os.getenv("CHUNK_STORE_MMAP_MB", 256))  # Memory-mapped, shared across worker processes
+# Index changes are logged in the chunk store and the index file is rewritten at most every CHECKPOINT_INTERVAL
+# seconds (0 disables the background checkpoint), or once CHECKPOINT_OPS changes are waiting
+checkpoint_interval = float(os.getenv("CHECKPOINT_INTERVAL", 30))
+checkpoint_ops = int(os.getenv("CHECKPOINT_OPS", 5000))
+
+# Vector index: auto, flat, hnsw, ivf_flat, ivf_pq or ivf_sq8
+index_type = os.getenv("INDEX_TYPE", "auto")
+hnsw_m = int(os.getenv("HNSW_M", 32))
+search_nprobe = int(os.getenv("SEARCH_NPROBE", 16))
+search_ef = int(os.getenv("SEARCH_EF", 64))
+# Vectors are normalized and searched by cosine similarity. INDEX_DIM > 0 stores them in the index reduced to that
+# many dimensions (INDEX_REDUCTION pca or truncate) for a cheaper first pass; SEARCH_RERANK times k candidates are
+# then re-scored with the full stored vectors (0 disables re-ranking)
+index_dim = int(os.getenv("INDEX_DIM", 0))
+index_reduction = os.getenv("INDEX_REDUCTION", "pca")
+search_rerank = int(os.getenv("SEARCH_RERANK", 4))
+
+# Retrieval: vector, lexical (BM25) or hybrid (both, fused with reciprocal rank fusion). Only vector hits are held
+# to SEARCH_MIN_SIMILARITY; lexical and hybrid search keep any BM25 match unless SEARCH_MIN_BM25 is raised
+search_mode = os.getenv("SEARCH_MODE", "vector")
+search_k = int(os.getenv("SEARCH_K", 2))
+search_min_similarity = float(os.getenv("SEARCH_MIN_SIMILARITY", 0.75))  # Cosine; 0.75 matches the old 0.4999 L2 cutoff
+search_min_bm25 = float(os.getenv("SEARCH_MIN_BM25", 0))
+search_candidates = int(os.getenv("SEARCH_CANDIDATES", 4))  # Candidates per retriever, as a multiple of k
+rrf_k = int(os.getenv("RRF_K", 60))
+# Context sent with each question: at most CONTEXT_TOKEN_BUDGET tokens, dropping passages that repeat an earlier one
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+context_duplicate_threshold = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", 0.8))
+batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", 4))  # Completions in flight per /chat/batch request
+batch_max_questions = int(os.getenv("BATCH_MAX_QUESTIONS", 100))  # Questions accepted per /chat/batch request
+
+# API server processes; each worker memory-maps the same index and chunk store
+api_workers = int(os.getenv("API_WORKERS", 1))
+
+# Chat caches; a TTL of 0 disables the cache
+query_cache_size = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+query_cache_ttl = float(os.getenv("QUERY_CACHE_TTL", 3600))
+answer_cache_size = int(os.getenv("ANSWER_CACHE_SIZE", 256))
+answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL", 0))
+
+# Conversation memory
+max_sessions = int(os.getenv("MAX_SESSIONS", 1000))
+history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+session_idle_ttl = float(os.getenv("SESSION_IDLE_TTL", 3600))
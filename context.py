@@ -0,0 +1,108 @@
+from dedup import normalized_words
+from tokens import count_tokens
+from config import context_token_budget, context_duplicate_threshold
+
+MIN_OVERLAP_WORDS = 5  # Shorter shared runs between passages are left alone as likely coincidences
+
+
+def citation(record):
+    """
+    Return the "source, page N" label of a chunk record, or None for chunks without a source.
+    """
+    source, page = record.get("source"), record.get("page")
+    if not source:
+        return None
+    return f"{source}, page {page}" if page else source
+
+
+def overlap(first, second):
+    """
+    Return the length of the longest run of words ending `first` that also starts `second`.
+    """
+    for size in range(min(len(first), len(second)), MIN_OVERLAP_WORDS - 1, -1):
+        if first[-size:] == second[:size]:
+            return size
+    return 0
+
+
+class ContextBuilder:
+    def __init__(self, token_budget=context_token_budget, duplicate_threshold=context_duplicate_threshold, shingle_size=3):
+        """
+        Assemble retrieved chunks into the context passed to the completion.
+
+        - **token_budget**: Maximum tokens of context, citations included.
+        - **duplicate_threshold**: Passages whose word shingles are at least this
+          fraction contained in a passage already packed are dropped.
+        - **shingle_size**: Words per shingle when comparing passages.
+        """
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.shingle_size = shingle_size
+
+    def shingles(self, words):
+        words = normalized_words(" ".join(words))
+        size = min(self.shingle_size, len(words)) or 1
+        return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+    def passages(self, records):
+        """
+        Select the passages to send, in the order given (best first).
+
+        Layout whitespace is collapsed, and words a passage shares with the start
+        or end of a packed passage from the same document (the overlap between
+        neighbouring chunks) are trimmed. Passages that then mostly repeat a packed one are
+        dropped. Passages that do not fit in what is left of the budget are
+        skipped, except the first, which is cut to fit.
+
+        Returns a list of dicts with the passage `text` and its `citation`.
+        """
+        packed, used = [], 0
+        for record in records:
+            if record is None:
+                continue
+            words = record["text"].split()
+            for other in packed:
+                if other["source"] != record.get("source"):
+                    continue
+                words = words[overlap(other["words"], words):]
+                words = words[:len(words) - overlap(words, other["words"])]
+            if not words:
+                continue
+            shingles = self.shingles(words)
+            if any(len(shingles & other["shingles"]) >= self.duplicate_threshold * len(shingles) for other in packed):
+                continue
+            passage = {"citation": citation(record), "source": record.get("source"), "words": words, "shingles": shingles}
+            tokens = count_tokens(self.render_passage(len(packed) + 1, passage))
+            if used + tokens > self.token_budget:
+                if packed:
+                    continue
+                passage["words"] = self.truncate(words, self.token_budget - (tokens - count_tokens(" ".join(words))))
+                tokens = self.token_budget
+            packed.append(passage)
+            used += tokens
+        return [{"text": " ".join(passage["words"]), "citation": passage["citation"]} for passage in packed]
+
+    @staticmethod
+    def truncate(words, budget):
+        """
+        Return the longest prefix of `words` within `budget` tokens.
+        """
+        kept, tokens = [], 0
+        for word in words:
+            tokens += count_tokens(" " + word)
+            if tokens > budget:
+                break
+            kept.append(word)
+        return kept
+
+    @staticmethod
+    def render_passage(number, passage):
+        text = passage["text"] if "text" in passage else " ".join(passage["words"])
+        label = f"[{number}] ({passage['citation']})" if passage["citation"] else f"[{number}]"
+        return f"{label} {text}"
+
+    def build(self, records):
+        """
+        Return the context string for the given chunk records (best first), or "" when there are none.
+        """
+        return "\n\n".join(self.render_passage(i, passage) for i, passage in enumerate(self.passages(records), 1))
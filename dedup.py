@@ -0,0 +1,149 @@
+import hashlib
+import re
+import zlib
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def normalized_words(text):
+    """
+    Return the lowercase words of `text`, ignoring punctuation and layout whitespace.
+    """
+    return re.findall(r"\w+", text.lower())
+
+
+class Deduplicator:
+    def __init__(self, store, mode="exact", threshold=0.85, num_perm=64, bands=8, shingle_size=3):
+        """
+        Detect chunks that repeat text already in the chunk store, before they are embedded.
+
+        - **store**: ChunkStore holding the content hash, MinHash signature and LSH
+          buckets of every chunk kept.
+        - **mode**: "exact" matches identical text (ignoring case, punctuation and
+          whitespace); "near" also matches chunks whose word shingles overlap by at least `threshold`.
+          A near match is skipped although its text differs, so the text it adds is not indexed.
+        - **threshold**: Minimum estimated Jaccard similarity of two chunks' `shingle_size`-word shingles.
+        - **num_perm**, **bands**: MinHash signature length and number of LSH bands.
+          With 64 permutations in 8 bands of 8, pairs above roughly 0.77 similarity
+          become candidates; candidates are then checked against `threshold`.
+        """
+        self.store = store
+        self.mode = mode
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, MAX_HASH, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MAX_HASH, num_perm, dtype=np.uint64)
+        self._backfilled = False
+
+    def text_hash(self, words):
+        return hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest()
+
+    def signature(self, words):
+        """
+        Return the MinHash signature (uint32 array of `num_perm` values) of a chunk's word shingles.
+        """
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        # Products of two 32-bit values fit in 64 bits, so the universal hash needs no big integers
+        permuted = (hashes[:, None] * self._a + self._b) % MERSENNE_PRIME
+        return (permuted.min(axis=0) & MAX_HASH).astype(np.uint32)
+
+    def buckets(self, signature):
+        """
+        Return one LSH bucket key per band of `signature`.
+        """
+        return [
+            int.from_bytes(hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest(), "little", signed=True)
+            for band in range(self.bands)
+        ]
+
+    def fingerprint(self, text):
+        """
+        Return the dedup fields stored with a kept chunk: `text_hash`, and in near mode `minhash` and `buckets`.
+        """
+        words = normalized_words(text)
+        fields = {"text_hash": self.text_hash(words)}
+        if self.mode == "near":
+            signature = self.signature(words)
+            fields["minhash"] = signature.tobytes()
+            fields["buckets"] = self.buckets(signature)
+        return fields
+
+    def backfill(self):
+        """
+        Fingerprint chunks stored before deduplication was enabled, so new uploads are compared against them too.
+        """
+        if self._backfilled:
+            return
+        while True:
+            rows = self.store.unfingerprinted(500, minhash=self.mode == "near")
+            if not rows:
+                break
+            self.store.put_fingerprints([(chunk_id, self.fingerprint(text)) for chunk_id, text in rows])
+        self._backfilled = True
+
+    def filter(self, chunks, ignore_ids=frozenset()):
+        """
+        Split a batch of chunk records into those to keep and those that duplicate earlier text.
+
+        Kept records gain the fingerprint fields to store with them. Returns
+        (kept, duplicates), where each duplicate is a (record, target, kind) tuple:
+        `target` is the id of the stored chunk it repeats, or the kept record of an
+        earlier chunk in the same batch. `kind` is "exact" or "near".
+        Stored chunks in `ignore_ids` (e.g. the previous version of a document
+        being replaced) are never matched.
+        """
+        self.backfill()
+        kept, duplicates = [], []
+        batch_hashes = {}  # text hash -> kept record
+        batch_buckets = {}  # (band, bucket) -> kept records
+        for chunk in chunks:
+            fields = self.fingerprint(chunk["text"])
+            target = batch_hashes.get(fields["text_hash"])
+            if target is None:
+                target = next((chunk_id for chunk_id in self.store.find_text_hash(fields["text_hash"]) if chunk_id not in ignore_ids), None)
+            if target is not None:
+                duplicates.append((chunk, target, "exact"))
+                continue
+            if self.mode == "near":
+                target = self.find_near(fields, batch_buckets, ignore_ids)
+                if target is not None:
+                    duplicates.append((chunk, target, "near"))
+                    continue
+            record = dict(chunk, **fields)
+            batch_hashes[fields["text_hash"]] = record
+            for band, bucket in enumerate(fields.get("buckets", ())):
+                batch_buckets.setdefault((band, bucket), []).append(record)
+            kept.append(record)
+        return kept, duplicates
+
+    def find_near(self, fields, batch_buckets, ignore_ids):
+        """
+        Return the batch record or stored chunk id most similar to `fields`, if any reaches `threshold`.
+        """
+        signature = np.frombuffer(fields["minhash"], dtype=np.uint32)
+        for band, bucket in enumerate(fields["buckets"]):
+            for record in batch_buckets.get((band, bucket), ()):
+                if self.similarity(signature, np.frombuffer(record["minhash"], dtype=np.uint32)) >= self.threshold:
+                    return record
+        candidates = [chunk_id for chunk_id in self.store.lsh_candidates(fields["buckets"]) if chunk_id not in ignore_ids]
+        best, best_score = None, self.threshold
+        for chunk_id, other in self.store.minhashes(candidates).items():
+            score = self.similarity(signature, other)
+            if score >= best_score:
+                best, best_score = chunk_id, score
+        return best
+
+    @staticmethod
+    def similarity(a, b):
+        """
+        Estimated Jaccard similarity of two MinHash signatures.
+        """
+        return float(np.mean(a == b))
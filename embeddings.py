@@ -0,0 +1,147 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+from openai_client import get_client
+from config import embed_provider, local_embed_model, local_embed_device, embed_dimensions
+from config import embed_batch_size, embed_concurrency, embed_max_retries
+
+EMBED_PROVIDERS = ("openai", "local")
+
+# Output sizes of the public OpenAI embedding models; other models and Azure deployments are probed once
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into fixed-size vectors.
+
+    Implementations set `name`, which identifies the model in cache keys so
+    vectors from different models are never mixed, and provide `embed` and
+    `dimension`.
+    """
+    name = None
+
+    def embed(self, texts, lane="chat"):
+        """
+        Return one vector (list of floats) per text, in the same order.
+
+        - **lane**: "chat" for questions, "ingest" for uploads, so remote providers can
+          serve interactive requests first.
+        """
+        raise NotImplementedError
+
+    @property
+    def dimension(self):
+        """
+        Length of the vectors this provider returns.
+        """
+        raise NotImplementedError
+
+
+class OpenAIEmbeddings(EmbeddingProvider):
+    def __init__(self, engine, batch_size=embed_batch_size, concurrency=embed_concurrency, max_retries=embed_max_retries,
+                 dimensions=embed_dimensions):
+        """
+        Embed through the (Azure) OpenAI embeddings API, using the credentials already set on the `openai` module.
+
+        Requests go through the shared `OpenAIClient`, which limits, coalesces and
+        retries them across every user of the model in this process.
+
+        - **engine**: Embedding model or Azure deployment name.
+        - **batch_size**: Texts sent per API request.
+        - **concurrency**: Requests in flight at once for one `embed` call; the client's per-model limit still applies.
+        - **max_retries**: Retries of a throttled or failed request before giving up.
+        - **dimensions**: Ask the API for embeddings shortened to this many dimensions
+          (text-embedding-3 models only); 0 keeps the model's full size.
+        """
+        self.name = f"{engine}@{dimensions}" if dimensions else engine
+        self.engine = engine
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._dimension = dimensions or OPENAI_DIMENSIONS.get(engine)
+        self.client = get_client()
+
+    @property
+    def dimension(self):
+        if self._dimension is None:
+            self._dimension = len(self.embed_batch(["dimension probe"])[0])
+        return self._dimension
+
+    def embed_batch(self, batch, lane="chat"):
+        """
+        Embed one batch of texts in a single API request.
+        """
+        return self.client.embed(self.engine, batch, lane, self.dimensions, self.max_retries)
+
+    def embed(self, texts, lane="chat"):
+        """
+        Embed the texts `batch_size` at a time over up to `concurrency` parallel requests.
+        """
+        texts = list(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            embeddings = self.embed_batch(batches[0], lane) if batches else []
+        else:
+            embeddings = []
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for batch_embeddings in executor.map(lambda batch: self.embed_batch(batch, lane), batches):
+                    embeddings.extend(batch_embeddings)
+        if self._dimension is None and embeddings:
+            self._dimension = len(embeddings[0])
+        return embeddings
+
+
+class LocalEmbeddings(EmbeddingProvider):
+    def __init__(self, model_path=local_embed_model, device=local_embed_device, batch_size=embed_batch_size):
+        """
+        Embed on this machine with a sentence-transformers model, without any network call.
+
+        - **model_path**: Local directory of the model, or a model name to load from the Hugging Face cache.
+          Set `HF_HUB_OFFLINE=1` for air-gapped deployments.
+        - **device**: Torch device to run on, "cpu" by default.
+        - **batch_size**: Texts encoded per forward pass.
+        """
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBED_PROVIDER=local requires the sentence-transformers package") from e
+        self.name = f"local:{model_path}"
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_path, device=device)
+        self._lock = threading.Lock()  # One forward pass at a time; the model already uses every core
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts, lane="chat"):
+        texts = list(texts)  # Runs locally, so there is no remote quota to share between lanes
+        if not texts:
+            return []
+        with self._lock:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32).tolist()
+
+
+@lru_cache(maxsize=None)
+def get_embedder(embed_model, provider=embed_provider):
+    """
+    Return the shared embedding provider selected by `provider` ("openai" or "local").
+
+    `embed_model` is the OpenAI model or deployment; the local provider loads
+    `LOCAL_EMBED_MODEL` instead. Providers are created once per process, so the
+    indexer and the retriever share one local model (and one rate-limit
+    limits) instead of loading their own.
+    """
+    if provider == "openai":
+        return OpenAIEmbeddings(embed_model)
+    if provider == "local":
+        return LocalEmbeddings(local_embed_model)
+    raise ValueError(f"Unknown embedding provider {provider!r}, expected one of {EMBED_PROVIDERS}")
@@ -1,9 +1,26 @@
 import openai
 import numpy as np
 import faiss
-import json
-import time
 import os
+import threading
+import time
+from contextlib import contextmanager
+from embed_cache import EmbeddingCache
+from embeddings import get_embedder
+from chunk_store import ChunkStore
+from chunker import batched_by_page, chunk_pages, numbered_pages, prefetch
+from registry import DocumentRegistry
+from read_pdf import PDFReader
+from dedup import Deduplicator
+from metrics import DUPLICATE_CHUNKS, span, timed_iter
+from checkpoint import bump_generation, read_generation, replay
+from process_lock import ProcessLock
+from vector_index import build_index, is_id_mapped, needs_rebuild, normalize_rows, reconstruct_all, remove_ids, resolve_type
+from vector_index import resolve_reduction, write_index_atomic
+from config import embed_cache_path, embed_cache_max_entries, dedup_mode, dedup_threshold
+from config import checkpoint_interval, checkpoint_ops
+from config import index_dim, index_reduction
+from config import chunk_store_path, index_type, hnsw_m, chunk_max_tokens, chunk_overlap_tokens, ingest_batch_chunks
 
 class TextIndexing:
     def __init__(self, api_key, api_type, api_version, api_base, embed_model):
@@ -15,8 +32,26 @@ class TextIndexing:
         openai.api_base = api_base
         openai.api_version = api_version
         self.embed_model = embed_model
+        self.embedder = get_embedder(embed_model)  # OpenAI or local model, selected by EMBED_PROVIDER
         self.index_path = "sample_index.index"
-        self.json_path = "sample_data.json"
+        self.json_path = "sample_data.json"  # Legacy chunk file, imported into the chunk store once
+        self.cache = EmbeddingCache(embed_cache_path, embed_cache_max_entries)
+        # Serializes uploads, deletes and checkpoints across threads and worker processes
+        self._write_lock = ProcessLock(self.index_path + ".lock")
+        self.store = ChunkStore(chunk_store_path, legacy_json_path=self.json_path, write_lock=self._write_lock)
+        self.index_type = index_type
+        self.index_dim = index_dim  # First-pass dimension of the index, 0 for full vectors
+        self.index_reduction = index_reduction
+        # Skips chunks whose text is already stored before they are embedded; None when DEDUP_MODE=off
+        self.dedup = Deduplicator(self.store, dedup_mode, dedup_threshold) if dedup_mode != "off" else None
+        self.registry = DocumentRegistry("pdf_names.json")
+        self._writes = 0  # Nesting depth of the write operations in progress in this process
+        self.generation = None  # Generation of the checkpoint the loaded index was read from or written as
+        self.indexer = None  # Index being written: the last checkpoint plus every logged change since; None between writes
+        self.applied_seq = 0  # Last logged change applied to the loaded index
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_ops = checkpoint_ops
+        self._checkpointer = None
 
     def preprocess_embeddings(self, embeddings):
         """
@@ -41,83 +76,449 @@ class TextIndexing:
 
     def embeddings_creation(self, chunks):
         """
-        Create embeddings for the given text chunks using OpenAI's API.
+        Create embeddings for the given text chunks with the configured embedding provider.
+
+        The returned embeddings are in the same order as the chunks.
+        """
+        paragraph = list(chunks)
+        with span("embedding", items=len(paragraph)):
+            embeddings = self.embedder.embed(paragraph, lane="ingest")  # Queued behind interactive questions
+        return embeddings, paragraph
+
+    def cached_embeddings_creation(self, chunks):
+        """
+        Create embeddings for the given chunks, only calling the API for chunks not already in the cache.
         """
-        paragraph = []
-        embeddings = []
+        paragraph = list(chunks)
+        embeddings = self.cache.get_many(self.embedder.name, paragraph)
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
 
-        for chunk in chunks:
-            paragraph.append(chunk)
-            if len(chunks) > 20:
-                time.sleep(1)
-            response = openai.Embedding.create(input=[chunk], engine=self.embed_model)
-            embeddings.append(response['data'][0]['embedding'])
+        if missing:
+            new_embeddings, _ = self.embeddings_creation([paragraph[i] for i in missing])
+            self.cache.put_many(self.embedder.name, [paragraph[i] for i in missing], new_embeddings)
+            for i, vector in zip(missing, new_embeddings):
+                embeddings[i] = vector
 
         return embeddings, paragraph
 
-    def load_or_create_indexer(self, embedding_dim):
+    @contextmanager
+    def _writing(self):
+        """
+        Hold the write lock for an upload, delete or checkpoint.
+
+        The full index is only loaded while a write is in progress and is
+        released when the outermost write finishes, so a worker process that
+        handled an upload does not keep a private copy of it. Searches use the
+        shared memory-mapped checkpoint instead (see `search.Searching`).
+        """
+        with self._write_lock:
+            self._writes += 1
+            try:
+                yield
+            finally:
+                self._writes -= 1
+                if not self._writes:
+                    self.indexer = None
+
+    def load_or_create_indexer(self, embedding_dim=None):
         """
-        Load an existing FAISS index or create a new one if it doesn't exist.
+        Return the FAISS index to write to, loading or creating it if the current write has not yet.
+
+        The index is loaded from the last checkpoint on disk and brought up to
+        date by replaying the changes logged in the chunk store since then, so
+        changes that were never checkpointed (e.g. after a crash) are recovered.
+        A missing index file, or one built with other index settings or before
+        vectors were normalized, is rebuilt from the stored vectors. A new index starts
+        as whatever `index_type` resolves to for an empty corpus; types that need
+        training start flat and are rebuilt once enough vectors exist.
+
+        Other worker processes may have changed the index since it was loaded:
+        their logged changes are replayed, and a checkpoint one of them wrote is
+        reloaded. Call with the write lock held.
+
+        Returns None when there is no index yet and `embedding_dim` is not given.
         """
+        generation = self.current_generation()
+        if self.indexer is not None and generation == self.generation:
+            if self.store.last_seq() > self.applied_seq:
+                self.indexer, self.applied_seq = replay(
+                    self.indexer, self.store, self.applied_seq, rebuild=lambda: self.rebuild_indexer(self.indexer)
+                )
+            return self.indexer
+        converted = False
+        # Read before the file: the file is replaced before the checkpoint is recorded, so it holds at least this much
+        seq = self.store.checkpoint_seq()
         if os.path.exists(self.index_path):
             print("Loading existing index...")
             indexer = faiss.read_index(self.index_path)
-        else:
+            if embedding_dim is not None and indexer.d != embedding_dim:
+                raise ValueError(
+                    f"Index holds {indexer.d}-dimensional vectors but the embedding model returns {embedding_dim}; "
+                    "delete the indexed files before switching embedding models"
+                )
+            converted = needs_rebuild(indexer, self.index_type, self.index_dim, self.index_reduction)
+            if converted:
+                # Written before vectors had explicit ids or were normalized, or with other index
+                # settings; convert it before adding to it
+                indexer = self.rebuild_indexer(indexer)
+            indexer, seq = replay(indexer, self.store, seq, rebuild=lambda: self.rebuild_indexer(indexer))
+        elif self.store.vector_count():
+            print("Index file missing, rebuilding from stored vectors...")
+            converted = True
+            seq = self.store.last_seq()
+            indexer = self.rebuild_indexer()
+        elif embedding_dim is not None:
             print("Creating new index...")
-            quantiser = faiss.IndexFlatL2(embedding_dim)
-            indexer = faiss.IndexIVFFlat(quantiser, embedding_dim, 1, faiss.METRIC_L2)
-            indexer.train(np.zeros((1, embedding_dim), dtype=np.float32))  # Dummy training
+            seq = self.store.last_seq()
+            indexer = build_index(resolve_type(self.index_type, 0), embedding_dim, hnsw_m=hnsw_m)
+        else:
+            return None
+        self.indexer, self.applied_seq, self.generation = indexer, seq, generation
+        if converted:
+            self.checkpoint()  # Readers cannot replay the log onto a legacy or missing index file
         return indexer
 
-    def embeddings_to_indexer(self, embeddings):
+    def needs_upgrade(self):
         """
-        Add embeddings to the FAISS indexer.
+        Check whether the index file is one readers cannot search: written before
+        checkpoints had a generation (without explicit ids or normalized vectors),
+        or missing while the chunk store holds vectors.
         """
-        try:
-            embeddings = self.preprocess_embeddings(embeddings)
-        except ValueError as e:
-            print(f"Error during preprocessing: {e}")
-            return None
+        if os.path.exists(self.index_path):
+            return not os.path.exists(self.index_path + ".gen")
+        return self.store.vector_count() > 0
 
-        embedding_dim = embeddings.shape[1]
-        indexer = self.load_or_create_indexer(embedding_dim)
+    def upgrade_index(self):
+        """
+        Convert a legacy index file, or rebuild a missing one, and checkpoint it so readers can search it.
 
-        if isinstance(indexer, faiss.IndexIVFFlat):
-            if not indexer.is_trained:
-                indexer.train(embeddings)
-        indexer.add(embeddings)
+        Call once at startup, before serving questions; otherwise `search.Searching`
+        refuses the file until the first upload or delete converts it. Does nothing,
+        without taking the write lock, when the index is already current.
+        """
+        if not self.needs_upgrade():
+            return
+        with self._writing():
+            # Another worker may have converted it while this one waited for the lock
+            if self.needs_upgrade() and self.load_or_create_indexer() is not None and self.needs_upgrade():
+                self.checkpoint()
 
-        faiss.write_index(indexer, self.index_path)
+    def rebuild_indexer(self, indexer=None):
+        """
+        Build a fresh index of the type suited to the current corpus size, trained on the stored vectors.
 
-        return indexer
+        Vectors are normalized, so indexes built before they were are converted to cosine similarity.
+        """
+        if indexer is not None and not is_id_mapped(indexer):
+            # Index written before ids were explicit: vector positions are the chunk ids,
+            # and chunks imported from the legacy JSON file have no stored vectors yet
+            self.store.put_vectors(*reconstruct_all(indexer))
+
+        ids, vectors = self.store.load_vectors()
+        target = resolve_type(self.index_type, len(ids))
+        print(f"Rebuilding index as {target} over {len(ids)} vectors...")
+        if len(ids) == 0:
+            return build_index(target, indexer.d, hnsw_m=hnsw_m)
+        vectors = normalize_rows(vectors)
+        reduced_dim = resolve_reduction(vectors.shape[1], self.index_dim, self.index_reduction, len(ids))
+        with span("index_rebuild", items=len(ids)):
+            new_indexer = build_index(
+                target, vectors.shape[1], vectors, hnsw_m=hnsw_m, reduced_dim=reduced_dim, reduction=self.index_reduction
+            )
+            new_indexer.add_with_ids(vectors, ids)
+        return new_indexer
+
+    def checkpoint(self):
+        """
+        Write the index to disk and record the last logged change it includes.
+
+        Until a checkpoint, changes live only in the chunk store's log, which
+        readers and the next write replay on top of the index file.
+        """
+        with self._writing():
+            if self.load_or_create_indexer() is None:
+                return
+            with span("index_write"):
+                write_index_atomic(self.indexer, self.index_path)
+            self.store.mark_checkpoint(self.applied_seq)
+            bump_generation(self.index_path)
+            self.generation = self.current_generation()
 
-    def load_existing_json(self):
+    def current_generation(self):
         """
-        Load existing data from the JSON file.
+        Return the generation of the index checkpoint on disk, or None if there is none.
         """
-        if os.path.exists(self.json_path):
-            with open(self.json_path, 'r') as file:
-                return json.load(file)
-        return []
+        return read_generation(self.index_path)
 
-    def update_json(self, new_data):
+    def start_checkpointer(self):
         """
-        Update the JSON file with new data.
+        Start a background thread that checkpoints the index `checkpoint_interval` seconds from now, unless one is waiting already.
+
+        The thread exits once nothing is left to checkpoint, so idle processes run none.
+        Call with the write lock held.
+        """
+        if self._checkpointer is not None or self.checkpoint_interval <= 0:
+            return
+        self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="index-checkpoint", daemon=True)
+        self._checkpointer.start()
+
+    def _checkpoint_loop(self):
+        while True:
+            time.sleep(self.checkpoint_interval)
+            try:
+                with self._writing():
+                    if self.store.last_seq() > self.store.checkpoint_seq():
+                        self.checkpoint()
+                    self._checkpointer = None
+                    return
+            except Exception as e:
+                print(f"Error: checkpoint failed: {e}")
+
+    def after_write(self, rebuilt=False):
+        """
+        Checkpoint after an upload or delete when the index was rebuilt, has no file yet,
+        or more than `checkpoint_ops` changes are waiting in the log. Otherwise the
+        changes are checkpointed `checkpoint_interval` seconds later.
         """
-        existing_data = self.load_existing_json()
-        existing_data.extend(new_data)
-        with open(self.json_path, 'w') as file:
-            json.dump(existing_data, file)
+        pending = self.store.last_seq() - self.store.checkpoint_seq()
+        if rebuilt or not os.path.exists(self.index_path) or pending >= self.checkpoint_ops:
+            self.checkpoint()
+        elif pending:
+            self.start_checkpointer()
 
-    def indexing(self, text):
+    def indexing(self, text, source=None, progress=None, sha256=None, resume=None, ignore_ids=()):
         """
         Perform the full indexing process for the provided text.
+
+        - **text**: Iterable of page texts (or (page_number, text) pairs) extracted from the PDF.
+          It may be a generator; pages are chunked and embedded as they arrive.
+        - **source**: Name of the PDF the pages come from, stored with each chunk.
+        - **progress**: Optional callback `progress(stage, **details)` reporting the
+          "embedding" and "indexing" stages with page, chunk and `duplicates` counts.
+        - **sha256**: Digest of the file. When given with `source`, each committed batch
+          records an upload checkpoint so a failed upload can be resumed.
+        - **resume**: Checkpoint of an interrupted upload of the same file
+          (see `ChunkStore.ingest_progress`); pages up to its `last_page` are skipped.
+        - **ignore_ids**: Stored chunks new chunks are not deduplicated against, e.g. those
+          of the version of the document being replaced.
+
+        Chunks repeating text already stored (or earlier in the upload) are not
+        embedded; the store records where they appeared instead (see `dedup.Deduplicator`).
+
+        Chunks are embedded in batches of at least `ingest_batch_chunks`, cut at page
+        boundaries. Each batch is committed to the chunk store, which logs the new
+        vectors, and added to the loaded index under the ids the store assigned.
+        The index file itself is only rewritten at checkpoints.
         """
+        with self._writing():
+            return self._indexing(text, source, progress, sha256, resume, frozenset(ignore_ids))
+
+    def _indexing(self, text, source, progress, sha256, resume, ignore_ids):
         try:
-            embeddings, paragraphs = self.embeddings_creation(text)
-            self.embeddings_to_indexer(embeddings)
-            self.update_json(paragraphs)
+            last_page = resume["last_page"] if resume else 0
+            chunk_count = resume["chunks"] if resume else 0
+            pages = (
+                (page_num, page) for page_num, page in numbered_pages(text) if page_num > last_page
+            )
+            # Both generators run on the prefetch thread; extraction time is reported separately from chunking
+            pages = timed_iter("extraction", pages)
+            chunks = prefetch(timed_iter("chunking", chunk_pages(pages, chunk_max_tokens, chunk_overlap_tokens, chunk_count)))
+            indexer = None
+            duplicates = 0
+            for batch in batched_by_page(chunks, ingest_batch_chunks):
+                records = [dict(chunk, source=source) for chunk in batch]
+                refs = []
+                if self.dedup is not None:
+                    with span("dedup", items=len(records)):
+                        records, skipped = self.dedup.filter(records, ignore_ids)
+                    for chunk, target, kind in skipped:
+                        DUPLICATE_CHUNKS.labels(kind).inc()
+                        refs.append((target, source, chunk.get("page")))
+                    duplicates += len(skipped)
+                checkpoint = None
+                if source is not None and sha256 is not None:
+                    checkpoint = {"source": source, "sha256": sha256, "last_page": batch[-1]["page"], "chunks": len(batch)}
+                if records:
+                    embeddings, _ = self.cached_embeddings_creation([record["text"] for record in records])
+                    embeddings = normalize_rows(self.preprocess_embeddings(embeddings))
+                    if indexer is None:
+                        indexer = self.load_or_create_indexer(embeddings.shape[1])
+                    with span("chunk_store", items=len(records)):
+                        ids = self.store.append(records, vectors=embeddings, progress=checkpoint, refs=refs)
+                    with span("index_add", items=len(ids)):
+                        indexer.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+                    self.applied_seq = self.store.last_seq()
+                else:
+                    # Nothing new to embed; still record the skipped duplicates and the pages done
+                    self.store.append([], progress=checkpoint, refs=refs)
+                chunk_count += len(batch)
+                if progress:
+                    progress(
+                        "embedding", pages=batch[-1]["page"], chunks=chunk_count, duplicates=duplicates,
+                        resumed_from_page=last_page,
+                    )
+
+            if progress:
+                progress("indexing", chunks=chunk_count, duplicates=duplicates, resumed_from_page=last_page)
+            if indexer is not None:
+                rebuilt = needs_rebuild(indexer, self.index_type, self.index_dim, self.index_reduction)
+                if rebuilt:
+                    self.indexer = self.rebuild_indexer(indexer)
+                self.after_write(rebuilt)
             return "done"
         except Exception as e:
             print(f"Error: {e}")
+            self.indexer = None  # Reload from the checkpoint and log, which hold everything committed
             return "fail"
+
+    def resume_point(self, name, sha256):
+        """
+        Return the checkpoint of an interrupted upload of this exact file, or None.
+
+        Callers can start extraction after its `last_page` instead of at page 1.
+        """
+        resume = self.store.ingest_progress(name)
+        if resume is None or sha256 is None or resume["sha256"] != sha256:
+            return None
+        return resume
+
+    def add_document(self, name, text, sha256=None, progress=None):
+        """
+        Index a document and record it in the document registry.
+
+        If a document with the same name is already registered it is replaced:
+        the new version is indexed first and the old chunks are removed only once
+        that succeeded, so a failed upload leaves the previous version in place.
+
+        Batches are committed as they complete. If an upload with the same name
+        and `sha256` failed earlier, it resumes after the last committed page, and
+        pages up to that one in `text` are skipped. A failed upload of different
+        content under the same name is discarded first.
+
+        The registry records the number of `chunks` stored for the document and of
+        `duplicates` skipped because their text was already indexed.
+        """
+        with self._writing():
+            resume = self.store.ingest_progress(name)
+            if resume is not None and self.resume_point(name, sha256) is None:
+                # Leftovers of an interrupted upload of other content
+                partial = [chunk_id for chunk_id in self.store.document_ids(name) if chunk_id >= resume["first_id"]]
+                if self.release_chunks(name, partial) != "done":
+                    return "fail"
+                self.store.drop_refs(name, since_id=resume["first_id"])
+                self.store.clear_ingest_progress(name)
+                resume = None
+            # Chunks and skipped duplicates below this id belong to the version being replaced
+            first_id = resume["first_id"] if resume else self.store.next_id()
+            old_ids = [chunk_id for chunk_id in self.store.document_ids(name) if chunk_id < first_id]
+            message = self.indexing(
+                text, source=name, progress=progress, sha256=sha256, resume=resume, ignore_ids=old_ids
+            )
+            if message != "done":
+                return message
+            if self.release_chunks(name, old_ids) != "done":
+                return "fail"
+            self.store.drop_refs(name, before_id=first_id)
+            self.store.clear_ingest_progress(name)
+            self.registry.add(
+                name, sha256=sha256, chunks=len(self.store.document_ids(name)), duplicates=self.store.ref_count(name)
+            )
+            return "done"
+
+    def ingest_file(self, path, name, sha256=None, progress=None, remove=False):
+        """
+        Extract, chunk, embed and index the PDF at `path` as the document `name`.
+
+        - **sha256**: Digest of the file, computed when not given.
+        - **progress**: Optional callback `progress(stage, **details)`, told when
+          extraction starts and then called as in `indexing`.
+        - **remove**: Delete the file afterwards, whatever the outcome (for spooled uploads).
+
+        A retry of an upload that failed part-way continues after its last
+        committed page, and a registered name is replaced (see `add_document`).
+        Returns "done" or "fail".
+        """
+        try:
+            if progress:
+                progress("extracting")
+            reader = PDFReader()
+            sha256 = sha256 or reader.file_sha256(path)
+            # Held from reading the resume point until the upload is committed, so two
+            # workers retrying the same file never both start from the same page
+            with self._writing():
+                resume = self.resume_point(name, sha256)
+                pages = reader.iter_file_pages(path, first_page=resume["last_page"] + 1 if resume else 1)
+                return self.add_document(name, pages, sha256=sha256, progress=progress)
+        except Exception as e:
+            print(f"Error: {e}")
+            return "fail"
+        finally:
+            if remove:
+                os.remove(path)
+
+    def remove_chunks(self, ids):
+        """
+        Remove the given chunk ids from the chunk store and the FAISS index.
+
+        Index types that cannot remove vectors in place (everything but flat) are
+        rebuilt from the remaining stored vectors and checkpointed straight away.
+        """
+        try:
+            with self._writing():
+                # Loading converts a legacy index while the stored vectors still match it
+                indexer = self.load_or_create_indexer()
+                self.store.delete_ids(ids)
+                if indexer is None:
+                    return "done"
+                rebuilt = not remove_ids(indexer, ids)
+                if rebuilt:
+                    self.indexer = self.rebuild_indexer(indexer)
+                self.applied_seq = self.store.last_seq()
+                self.after_write(rebuilt)
+                return "done"
+        except Exception as e:
+            print(f"Error: {e}")
+            self.indexer = None
+            return "fail"
+
+    def release_chunks(self, name, ids):
+        """
+        Remove chunks of the document `name`, except those that duplicates skipped in
+        other documents point to: those are handed over to one of those documents.
+        """
+        if not ids:
+            return "done"
+        with self._writing():
+            handed = self.store.hand_over(ids, name)
+            remaining = [chunk_id for chunk_id in ids if chunk_id not in handed]
+            return self.remove_chunks(remaining) if remaining else "done"
+
+    def delete_document(self, name):
+        """
+        Remove a single document's chunks and vectors and drop it from the registry.
+
+        Returns "done", "missing" if the document is unknown, or "fail".
+        """
+        with self._writing():
+            ids = self.store.document_ids(name)
+            if not ids and name not in self.registry:
+                return "missing"
+            message = self.release_chunks(name, ids)
+            if message == "done":
+                self.store.drop_refs(name)
+                self.store.clear_ingest_progress(name)
+                self.registry.remove(name)
+            return message
+
+    def clear(self):
+        """
+        Delete the index file and every chunk, vector and registry entry.
+        """
+        with self._writing():
+            self.indexer = None
+            self.applied_seq = 0
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self.store.clear()
+            self.registry.clear()
+            bump_generation(self.index_path)  # Tells every process to drop its copy of the index
@@ -0,0 +1,152 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JSON_FIELDS = ("progress", "result")
+ACTIVE = ("queued", "running")
+ORPHANED_ERROR = "Interrupted: the worker running this job stopped"
+
+
+class JobQueue:
+    def __init__(self, workers=1, max_jobs=1000, path=":memory:", heartbeat_interval=10):
+        """
+        Initialize a background job queue.
+
+        - **workers**: Number of jobs run at the same time. Ingestion uses one so
+          uploads are written to the index one after another.
+        - **max_jobs**: Number of job records kept; the oldest finished jobs are dropped beyond this.
+        - **path**: SQLite file the job records are kept in. Worker processes given
+          the same file see each other's jobs, so a job's status can be polled
+          from any of them. Jobs still run in the process they were submitted to.
+          By default records are kept in this process's memory.
+        - **heartbeat_interval**: Seconds between the timestamps this queue writes
+          on its queued and running jobs. A job whose timestamp is three intervals
+          old was left behind by a worker that crashed or restarted, and is
+          reported as failed.
+        """
+        self.max_jobs = max_jobs
+        self.heartbeat_interval = heartbeat_interval
+        self._lock = threading.Lock()
+        self._active = set()  # Queued and running jobs of this queue, kept alive by the heartbeat
+        self._heartbeat = None
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY, name TEXT, status TEXT NOT NULL, stage TEXT,
+                progress TEXT NOT NULL, error TEXT, result TEXT,
+                created_at REAL NOT NULL, updated_at REAL NOT NULL, heartbeat REAL NOT NULL DEFAULT 0
+            )"""
+        )
+        if "heartbeat" not in [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+            # Tables created before jobs had a heartbeat
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL NOT NULL DEFAULT 0")
+        self._fail_orphans()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def _stale_before(self):
+        return time.time() - 3 * self.heartbeat_interval
+
+    def _fail_orphans(self):
+        """
+        Mark the queued and running jobs nobody keeps alive any more as failed.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE status IN (?, ?) AND heartbeat < ?",
+                (ORPHANED_ERROR, time.time(), *ACTIVE, self._stale_before()),
+            )
+
+    def submit(self, func, *args, name=None):
+        """
+        Queue `func(*args, progress=...)` to run in the background and return its job id.
+
+        `progress(stage, **details)` lets the job report which stage it is in
+        along with counters such as pages or chunks processed.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO jobs (job_id, name, status, stage, progress, error, result, created_at, updated_at, heartbeat)
+                VALUES (?, ?, 'queued', NULL, '{}', NULL, 'null', ?, ?, ?)""",
+                (job_id, name, now, now, now),
+            )
+            self._trim()
+            self._active.add(job_id)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+        self._executor.submit(self._run, job_id, func, args)
+        return job_id
+
+    def _beat(self):
+        # Exits once this queue has no jobs left, so idle processes run no thread
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                if not self._active:
+                    self._heartbeat = None
+                    return
+                active = list(self._active)
+                self._conn.execute(
+                    f"UPDATE jobs SET heartbeat = ? WHERE job_id IN ({', '.join('?' * len(active))})",
+                    (time.time(), *active),
+                )
+
+    def _run(self, job_id, func, args):
+        self.update(job_id, status="running")
+
+        def progress(stage, **details):
+            self.update(job_id, stage=stage, progress=details)
+
+        try:
+            result = func(*args, progress=progress)
+            self.update(job_id, status="done", result=result)
+        except Exception as e:
+            print(f"Error: job {job_id} failed: {e}")
+            self.update(job_id, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def update(self, job_id, **fields):
+        """
+        Update the stored fields of a job.
+        """
+        fields = {key: json.dumps(value) if key in JSON_FIELDS else value for key, value in fields.items()}
+        fields["updated_at"] = fields["heartbeat"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        """
+        Return a copy of the job record, or None if the id is unknown.
+
+        A queued or running job that its worker stopped keeping alive is reported as failed.
+        """
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip((column[0] for column in cursor.description), row))
+        if job["status"] in ACTIVE and job["heartbeat"] < self._stale_before():
+            job.update(status="failed", error=ORPHANED_ERROR)
+        del job["heartbeat"]
+        for key in JSON_FIELDS:
+            job[key] = json.loads(job[key])
+        return job
+
+    def _trim(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - self.max_jobs
+        if excess > 0:
+            self._conn.execute(
+                """DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs WHERE status IN ('done', 'failed')
+                ORDER BY created_at LIMIT ?)""",
+                (excess,),
+            )
@@ -1,10 +1,14 @@
 import streamlit as st
+import fitz  # PyMuPDF
 from read_pdf import PDFReader
 from index import TextIndexing
 from qna import ChatBot
+from jobs import JobQueue
 from config import api_version, api_type
+import io
 import os
-import json
+import uuid
+import hashlib
 
 st.sidebar.title("💬 Chatbot")
 
@@ -28,10 +32,66 @@ if submit_button:
     else: 
         st.sidebar.success("Submitted successfully!")
 
+@st.cache_resource(show_spinner=False)
+def load_backend(api_key, api_base, model, embed_model):
+    """
+    Create the indexer and chatbot once per set of credentials, shared across reruns and browser sessions.
+    """
+    index = TextIndexing(api_key, api_type, api_version, api_base, embed_model)  # This handles the indexing of text data
+    index.upgrade_index()  # Convert a legacy index before the chatbot searches it
+    qna = ChatBot(api_key, api_type, api_version, api_base, model, embed_model)  # This manages interactions with the chatbot
+    return index, qna
+
+@st.cache_resource
+def ingestion_queue():
+    """
+    Background queue that indexes uploads one at a time, so reruns are never blocked by an ingestion.
+    """
+    return JobQueue(workers=1)
+
+@st.cache_data(show_spinner=False)
+def pdf_pages(data):
+    """
+    Extract the text of an uploaded PDF once per file content.
+    """
+    return PDFReader().extract_text_from_pdf(io.BytesIO(data))
+
+def ingest_upload(index, path, filename, sha256, progress):
+    """
+    Background ingestion job: extract, chunk, embed and index a spooled PDF, then remove the temporary file.
+    """
+    # Uploading a registered name replaces that document instead of duplicating it
+    if index.ingest_file(path, filename, sha256=sha256, progress=progress, remove=True) != "done":
+        raise RuntimeError("Indexing failed")
+    return {"file": filename}
+
 # Initialize the indexing and chatbot
-index = TextIndexing(api_key, api_type, api_version, api_base, embed_model)  # This handles the indexing of text data
-qna = ChatBot(api_key, api_type, api_version, api_base, model,embed_model)  # This manages interactions with the chatbot
+index, qna = load_backend(api_key, api_base, model, embed_model)
+ingestion_jobs = ingestion_queue()
 
+# Uploads already handled in this session: uploader file id -> (ingestion job id or None, page count)
+if 'ingestions' not in st.session_state:
+    st.session_state.ingestions = {}
+
+@st.fragment(run_every=1)
+def ingestion_progress(job_id, page_count):
+    """
+    Show the stage of a running ingestion, refreshing only this fragment until the job finishes.
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None or job["status"] in ("done", "failed"):
+        st.rerun()  # Redraw the whole page with the outcome and the updated PDF list
+    pages = job["progress"].get("pages", 0)
+    if job["stage"] == "embedding":
+        resumed = job["progress"].get("resumed_from_page")
+        duplicates = job["progress"].get("duplicates")
+        text = f"Embedding page {pages} of {page_count}" + (f" (resumed after page {resumed})" if resumed else "")
+        text += f", {duplicates} duplicate chunks skipped" if duplicates else ""
+        st.progress(min(pages / max(page_count, 1), 1.0), text=text)
+    elif job["stage"] == "indexing":
+        st.progress(1.0, text="Writing the index")
+    else:
+        st.progress(0.0, text="Waiting to be indexed" if job["status"] == "queued" else "Extracting text")
 
 # File uploader widget for PDF files
 uploaded_file = st.sidebar.file_uploader("Upload a PDF file", type="pdf")
@@ -46,23 +106,40 @@ if uploaded_file is not None:
     elif not embed_model:
         st.sidebar.error("Embedding Model Name Missing")
     else:
-        pdf_reader = PDFReader()
-        # Extract and display text from the PDF file
-        pdf_text, message = pdf_reader.extract_text_from_pdf(uploaded_file)
-        
-        if message == "done":
-            index_message = index.indexing(pdf_text)
-            if index_message == "done":
-                add_message=pdf_reader.pdf_add(uploaded_file.name)
-                if add_message == "done":
-                    st.sidebar.success("File uploaded successfully 👍")
-                else:
-                    st.sidebar.error("Filed store PDF Name 😒")
-            else:
-                st.sidebar.error("File indexing failed 😒")
-            
-            # Button to show the text
-            if st.button('Show PDF Text'):
+        data = uploaded_file.getvalue()
+        if uploaded_file.file_id not in st.session_state.ingestions:
+            # The uploader returns the same file on every rerun; ingest each upload once, and only if its content is new
+            sha256 = hashlib.sha256(data).hexdigest()
+            job_id = None
+            page_count = 0
+            if index.registry.find_sha256(sha256) is None:
+                pdf_reader = PDFReader()
+                path = pdf_reader.spool(io.BytesIO(data))
+                with fitz.open(path) as pdf_document:
+                    page_count = len(pdf_document)
+                job_id = ingestion_jobs.submit(ingest_upload, index, path, uploaded_file.name, sha256, name=uploaded_file.name)
+            st.session_state.ingestions[uploaded_file.file_id] = (job_id, page_count)
+
+        job_id, page_count = st.session_state.ingestions[uploaded_file.file_id]
+        job = ingestion_jobs.get(job_id) if job_id else None
+        if job_id is None:
+            st.sidebar.success("File already indexed 👍")
+        elif job is None or job["status"] == "failed":
+            st.sidebar.error("File indexing failed 😒")
+            if st.sidebar.button("Retry indexing"):
+                # Submitted again on the rerun; pages committed before the failure are not embedded again
+                del st.session_state.ingestions[uploaded_file.file_id]
+                st.rerun()
+        elif job["status"] == "done":
+            st.sidebar.success("File uploaded successfully 👍")
+        else:
+            with st.sidebar:
+                ingestion_progress(job_id, page_count)
+
+        # Button to show the text
+        if st.button('Show PDF Text'):
+            pdf_text, message = pdf_pages(data)
+            if message == "done":
                 pdf_text1 = "\n".join(pdf_text)
                 # Create a container for text with custom styling
                 with st.container():
@@ -81,14 +158,13 @@ if uploaded_file is not None:
                         """,
                         unsafe_allow_html=True
                     )
-        else:
-            st.sidebar.error("File Read failed 😒")
+            else:
+                st.sidebar.error("File Read failed 😒")
 
 
 
 # Define the file paths to be deleted
 INDEX_FILE_PATH = "sample_index.index"
-JSON_FILE_PATH = "sample_data.json"
 PDF_NAMES="pdf_names.json"
 
 # Initialize session state for the list visibility in the sidebar
@@ -103,32 +179,24 @@ def toggle_list():
 with st.sidebar:
     st.button("View PDFs List", on_click=toggle_list)
 
-    # Conditionally display the list based on session state
+    # Conditionally display the list based on session state, with a delete button per document
     if st.session_state.show_list:
-        try:
-            with open('pdf_names.json', 'r') as f:
-                data = json.load(f)
-            list_markdown = "\n".join(f"- {item}" for item in data)
-            st.markdown(list_markdown)
-        except:
+        names = index.registry.names()
+        if not names:
             st.markdown("No PDFs Available")
-
-def delete_file(file_path: str):
-    """Delete a file and return the status."""
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            return {"status": "success", "file": file_path}
-        else:
-            return {"status": "error", "file": file_path, "message": "File does not exist"}
-    except Exception as e:
-        return {"status": "error", "file": file_path, "message": str(e)}
+        for name in names:
+            name_col, delete_col = st.columns([4, 1])
+            name_col.markdown(f"- {name}")
+            if delete_col.button("🗑️", key=f"delete_{name}", help=f"Delete {name}"):
+                if index.delete_document(name) == "done":
+                    st.success(f"Deleted {name}")
+                else:
+                    st.error(f"Failed to delete {name}")
 
 if st.sidebar.button("Delete all PDFs"):
-    index_result = delete_file(INDEX_FILE_PATH)
-    json_result = delete_file(JSON_FILE_PATH)
-    pdf_name_result=delete_file(PDF_NAMES)
-    if index_result["status"] == "success" and json_result["status"] == "success" and pdf_name_result["status"] == "success":
+    had_pdfs = os.path.exists(INDEX_FILE_PATH) and os.path.exists(PDF_NAMES)
+    index.clear()  # Deletes the index file, the chunk store and the document registry
+    if had_pdfs:
         st.sidebar.success("Deleted all PDFs")
     else:
         st.sidebar.error("PDFs is unavailable")
@@ -146,6 +214,9 @@ def main():
         st.session_state.chat_history = []
     if 'user_input' not in st.session_state:
         st.session_state.user_input = ""
+    # Each browser session gets its own conversation history in the chatbot
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
 
     # Function to handle sending a message
     def handle_send(user_input):
@@ -161,19 +232,25 @@ def main():
                 """
             )
 
-            # Generate bot response
-            bot_response = qna.get_bot_response(user_input)
-            
-            # Add bot response to chat history
-            st.session_state.chat_history.append(
-                f"""
+            def bot_bubble(text):
+                return f"""
                 <div style='margin-bottom: 10px;'>
                     <div style='display: inline-block; max-width: 80%; padding: 10px; border-radius: 20px; background-color: #F0F0F0; color: black;'>
-                        {bot_response['message']}
+                        {text}
                     </div>
                 </div>
                 """
-            )
+
+            # Stream the bot response into a placeholder as it is generated
+            placeholder = st.empty()
+            bot_response = ""
+            for token in qna.get_bot_response_stream(user_input, st.session_state.session_id):
+                bot_response += token
+                placeholder.markdown(bot_bubble(bot_response), unsafe_allow_html=True)
+            placeholder.empty()
+            
+            # Add bot response to chat history
+            st.session_state.chat_history.append(bot_bubble(bot_response))
 
 
     # Form for chat input
@@ -0,0 +1,71 @@
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram
+
+# Buckets from 1 ms to 2 minutes, covering both single searches and whole-document ingestion stages
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "pdf_chatbot_stage_seconds", "Time spent in each upload and chat stage", ["stage"], buckets=BUCKETS
+)
+STAGE_ITEMS = Counter("pdf_chatbot_stage_items_total", "Items (pages, chunks, vectors) processed by each stage", ["stage"])
+STAGE_ERRORS = Counter("pdf_chatbot_stage_errors_total", "Exceptions raised in each stage", ["stage"])
+DUPLICATE_CHUNKS = Counter(
+    "pdf_chatbot_duplicate_chunks_total", "Chunks skipped at ingest because their text was already indexed", ["kind"]
+)
+
+_local = threading.local()
+
+
+@contextmanager
+def span(stage, items=None):
+    """
+    Time the enclosed block as one observation of `stage`, counting `items` processed and any exception raised.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+        if items:
+            STAGE_ITEMS.labels(stage).inc(items)
+
+
+def timed_iter(stage, iterable):
+    """
+    Wrap a generator stage, recording the total time spent producing its items as one observation of `stage`.
+
+    Time spent in timed generators nested inside this one (e.g. extraction
+    feeding the chunker) is attributed to the inner stage only.
+    """
+    stack = _local.__dict__.setdefault("stack", [])
+    iterator = iter(iterable)
+    total = 0.0
+    count = 0
+    try:
+        while True:
+            child_time = [0.0]
+            stack.append(child_time)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception:
+                STAGE_ERRORS.labels(stage).inc()
+                raise
+            finally:
+                stack.pop()
+                elapsed = time.perf_counter() - start
+                total += elapsed - child_time[0]
+                if stack:
+                    stack[-1][0] += elapsed
+            count += 1
+            yield item
+    finally:
+        STAGE_SECONDS.labels(stage).observe(total)
+        STAGE_ITEMS.labels(stage).inc(count)
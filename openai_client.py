@@ -0,0 +1,297 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+import openai
+from prometheus_client import Counter
+from tokens import count_tokens
+from config import openai_max_concurrency, openai_tokens_per_minute, openai_interactive_reserve, openai_max_retries
+
+LANES = ("chat", "ingest")
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+    openai.error.Timeout, openai.error.APIConnectionError,
+)
+
+OPENAI_REQUESTS = Counter(
+    "pdf_chatbot_openai_requests_total",
+    "Outbound OpenAI requests by model and outcome (ok, retry, error, or coalesced into an identical request in flight)",
+    ["model", "outcome"],
+)
+
+
+class SingleFlight:
+    """
+    Runs identical calls made at the same time only once, handing every caller the same result.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Return `func()`, or the result of the call already running under `key`.
+
+        Callers that joined an existing call get the same object back, so they must not modify it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class ModelLimiter:
+    def __init__(self, max_concurrency, tokens_per_minute=0, interactive_reserve=0.25):
+        """
+        Admission control for the requests sent to one model or deployment.
+
+        - **max_concurrency**: Requests in flight at once.
+        - **tokens_per_minute**: Token rate allowed, as a bucket refilled continuously
+          that holds one minute's worth; 0 disables the rate limit.
+        - **interactive_reserve**: Fraction of the request slots and of the token
+          bucket that "ingest" requests leave free for "chat" requests. Ingest
+          requests also wait while any chat request is waiting.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved_slots = min(self.max_concurrency - 1, round(self.max_concurrency * interactive_reserve))
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved_tokens = tokens_per_minute * interactive_reserve
+        self._cond = threading.Condition()
+        self._running = dict.fromkeys(LANES, 0)
+        self._waiting = dict.fromkeys(LANES, 0)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._cooldown_until = 0.0
+
+    def _wait_time(self, lane, tokens, now):
+        """
+        Seconds until a `lane` request of `tokens` tokens may start, 0 if it may start now,
+        or None if it has to wait for another request to finish.
+        """
+        if now < self._cooldown_until:
+            return self._cooldown_until - now
+        if sum(self._running.values()) >= self.max_concurrency:
+            return None
+        if lane == "ingest" and (
+            self._waiting["chat"] or self._running["ingest"] >= self.max_concurrency - self.reserved_slots
+        ):
+            return None
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute, self._tokens + (now - self._updated) * self.tokens_per_minute / 60
+            )
+            self._updated = now
+            floor = self.reserved_tokens if lane == "ingest" else 0
+            # A request larger than the bucket runs once the bucket is full, leaving it in debt
+            deficit = min(tokens, self.tokens_per_minute - floor) + floor - self._tokens
+            if deficit > 0:
+                return deficit * 60 / self.tokens_per_minute
+        return 0
+
+    def acquire(self, lane, tokens=0):
+        """
+        Block until a `lane` ("chat" or "ingest") request of about `tokens` tokens may be sent, and take its slot.
+        """
+        with self._cond:
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    wait = self._wait_time(lane, tokens, time.monotonic())
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[lane] -= 1
+            self._running[lane] += 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+
+    def release(self, lane):
+        """
+        Free the slot of a finished `lane` request.
+        """
+        with self._cond:
+            self._running[lane] -= 1
+            self._cond.notify_all()
+
+    def cool_down(self, delay):
+        """
+        Hold every new request to this model for `delay` seconds after a rate-limit response.
+        """
+        with self._cond:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+            self._cond.notify_all()
+
+
+class OpenAIClient:
+    def __init__(self, max_concurrency=openai_max_concurrency, tokens_per_minute=openai_tokens_per_minute,
+                 interactive_reserve=openai_interactive_reserve, max_retries=openai_max_retries):
+        """
+        Shared gateway for (Azure) OpenAI calls, using the credentials already set on the `openai` module.
+
+        Every model or deployment gets its own `ModelLimiter`. Identical embedding
+        or completion requests in flight at the same time are sent once. Throttled
+        and transient failures are retried with jittered exponential backoff, and a
+        rate-limit response pauses every request to that model for its Retry-After time.
+
+        - **max_concurrency**: Requests in flight per model.
+        - **tokens_per_minute**: Token rate allowed per model (the deployment's quota); 0 for no limit.
+        - **interactive_reserve**: Share of each model's capacity kept for chat requests.
+        - **max_retries**: Retries of a failed request before its error is raised.
+        """
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+    def limiter(self, model):
+        """
+        Return the limiter of `model`, creating it on first use.
+        """
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = ModelLimiter(self.max_concurrency, self.tokens_per_minute, self.interactive_reserve)
+            return self._limiters[model]
+
+    @staticmethod
+    def backoff(attempt, error):
+        """
+        Seconds to wait before retry number `attempt` (from 0): the Retry-After header when the
+        service sent one, otherwise a random delay up to 2 ** attempt seconds, capped at 60.
+        """
+        headers = getattr(error, 'headers', None) or {}
+        retry_after = headers.get('retry-after')
+        if retry_after:
+            delay = float(retry_after)
+            return delay + random.uniform(0, 0.1 * delay + 0.1)  # Keep waiting callers from retrying in lockstep
+        return random.uniform(0, min(60.0, 2.0 ** attempt))
+
+    def call(self, model, lane, tokens, request, max_retries=None, keep_slot=False):
+        """
+        Send `request()` to `model` through its limiter, retrying throttled and transient failures.
+
+        - **lane**: "chat" for interactive requests, "ingest" for uploads.
+        - **tokens**: Estimated tokens the request uses, charged to the rate limit.
+        - **keep_slot**: Keep the request slot after success, for a streamed response;
+          the caller then releases it with `limiter(model).release(lane)`.
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}, expected one of {LANES}")
+        max_retries = self.max_retries if max_retries is None else max_retries
+        limiter = self.limiter(model)
+        for attempt in range(max_retries + 1):
+            limiter.acquire(lane, tokens)
+            try:
+                result = request()
+            except RETRYABLE_ERRORS as e:
+                limiter.release(lane)
+                if attempt == max_retries:
+                    OPENAI_REQUESTS.labels(model, "error").inc()
+                    raise
+                OPENAI_REQUESTS.labels(model, "retry").inc()
+                delay = self.backoff(attempt, e)
+                print(f"OpenAI request to {model} failed, retrying in {delay:.1f}s: {e}")
+                if isinstance(e, openai.error.RateLimitError):
+                    limiter.cool_down(delay)  # Every request to this model waits, not just this one
+                else:
+                    time.sleep(delay)
+                continue
+            except BaseException:
+                limiter.release(lane)
+                OPENAI_REQUESTS.labels(model, "error").inc()
+                raise
+            if not keep_slot:
+                limiter.release(lane)
+            OPENAI_REQUESTS.labels(model, "ok").inc()
+            return result
+
+    def coalesced(self, model, key, func):
+        """
+        Run `func()` once for all identical requests (same `key`) in flight together.
+        """
+        leader = []
+
+        def run():
+            leader.append(True)
+            return func()
+
+        result = self._single_flight.do(key, run)
+        if not leader:
+            OPENAI_REQUESTS.labels(model, "coalesced").inc()
+        return result
+
+    def embed(self, engine, texts, lane="chat", dimensions=0, max_retries=None):
+        """
+        Embed one batch of texts in a single request and return the vectors in order.
+        """
+        texts = list(texts)
+        options = {"dimensions": dimensions} if dimensions else {}
+
+        def request():
+            response = openai.Embedding.create(input=texts, engine=engine, **options)
+            data = sorted(response['data'], key=lambda item: item['index'])
+            return [item['embedding'] for item in data]
+
+        tokens = sum(count_tokens(text) for text in texts)
+        return self.coalesced(
+            engine, ("embed", engine, dimensions, tuple(texts)),
+            lambda: self.call(engine, lane, tokens, request, max_retries),
+        )
+
+    def complete(self, engine, messages, lane="chat", **options):
+        """
+        Run a chat completion and return the text of its answer.
+        """
+        def request():
+            response = openai.ChatCompletion.create(engine=engine, messages=messages, **options)
+            return response.choices[0]['message']['content']
+
+        tokens = sum(count_tokens(message["content"]) for message in messages)
+        key = ("complete", engine, json.dumps(messages, sort_keys=True), json.dumps(options, sort_keys=True))
+        return self.coalesced(engine, key, lambda: self.call(engine, lane, tokens, request))
+
+    def stream(self, engine, messages, lane="chat", **options):
+        """
+        Run a streamed chat completion and yield its chunks.
+
+        Streams are not coalesced, and only the initial request is retried. The
+        request slot is held until the stream ends.
+        """
+        tokens = sum(count_tokens(message["content"]) for message in messages)
+        response = self.call(
+            engine, lane, tokens,
+            lambda: openai.ChatCompletion.create(engine=engine, messages=messages, stream=True, **options),
+            keep_slot=True,
+        )
+        try:
+            yield from response
+        finally:
+            self.limiter(engine).release(lane)
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """
+    Return the process-wide OpenAI client, so the indexer, retriever and chatbot share its limits.
+    """
+    return OpenAIClient()
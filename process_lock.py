@@ -0,0 +1,37 @@
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+class ProcessLock:
+    def __init__(self, path):
+        """
+        Reentrant lock shared by the threads of this process and, through an advisory
+        `flock` on `path`, by every process that opens the same lock file.
+
+        Uvicorn workers each have their own indexer; holding this lock while
+        modifying the index and chunk store keeps their writes from interleaving.
+        """
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+        return False
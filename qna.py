@@ -1,11 +1,22 @@
 from search import Searching
 import openai
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 from prompts import system_prompt
+from cache import TTLCache, normalize_text
+from sessions import SessionStore
+from metrics import span, timed_iter
+from openai_client import get_client
+from config import answer_cache_size, answer_cache_ttl, max_sessions, history_token_budget, session_idle_ttl
+from config import batch_concurrency, chunk_store_path
+
+DEFAULT_SESSION = "default"  # Session used by callers that do not pass their own id
 
 class ChatBot:
     def __init__(self,api_key, api_type, api_version, api_base,model,embed_model):
         """
-        Initialize the ChatBot class by setting up OpenAI API credentials and chat history.
+        Initialize the ChatBot class by setting up OpenAI API credentials and the per-session chat history store.
         """
         self.api_key = api_key
         self.api_type = api_type
@@ -17,68 +28,218 @@ class ChatBot:
         openai.api_version = api_version
         self.model=model
         self.embed_model=embed_model
-        self.chat_history = []  # Initialize an empty list to store chat history
+        # Shared with the embedding provider: per-model limits, retries and coalescing of identical requests
+        self.client = get_client()
+        # Conversation history per session, trimmed to a token budget and shared by worker processes
+        self.sessions = SessionStore(max_sessions, history_token_budget, session_idle_ttl, path=chunk_store_path)
+        # Long-lived retriever; keeps the index and chunks in memory between questions
+        self.search = Searching(api_key, api_type, api_version, api_base, embed_model)
+        # Optional cache of answers, keyed on the index generation so uploads and deletes invalidate it
+        self.answer_cache = TTLCache(answer_cache_size, answer_cache_ttl)
+
+    def build_messages(self, user_input, docs, session_id=DEFAULT_SESSION):
+        """
+        Build the message list for a completion request from the system prompt, the session's history and the query with its context.
+
+        A `session_id` of None builds a stateless request without history. When
+        `docs` is empty (nothing relevant was found) the context section is left out.
+        """
+        delimiter = "####"  # Delimiter used to separate sections in the context
+
+        # Create the initial messages for the chat history
+        messages = [{"role": "system", "content": system_prompt}]
+        context = f'''Query:
+    {delimiter} {user_input} {delimiter}
+    '''
+        if docs:
+            context += f'''
+    context:
+    {delimiter} {docs} {delimiter}
+    '''
+        
+        # The session store keeps each history within its token budget
+        if session_id is not None:
+            messages += self.sessions.get(session_id)
+        # Add the user query to the messages
+        messages.append({'role': 'user', 'content': context})
+        return messages
+
+    def update_history(self, user_input, answer, session_id=DEFAULT_SESSION):
+        """
+        Update the session's chat history with the user input and the assistant's response.
+        """
+        if session_id is not None:
+            self.sessions.append(session_id, user_input, answer)
+
+    def answer_key(self, user_input, session_id=DEFAULT_SESSION, search_params=None):
+        """
+        Return the answer-cache key for a question, or None when the answer cache is disabled.
+
+        The key covers the index generation, the normalized question, the search
+        settings and the conversation so far, so an answer is only reused for the
+        same corpus and context.
+        """
+        if not self.answer_cache.enabled:
+            return None
+        self.search.refresh()
+        history = self.sessions.get(session_id) if session_id is not None else []
+        history = hashlib.sha256(json.dumps(history).encode("utf-8")).hexdigest()
+        return ((self.search.generation, self.search.applied_seq), normalize_text(user_input), tuple(sorted((search_params or {}).items())), history)
+
+    def complete(self, messages):
+        """
+        Generate a response using OpenAI's ChatCompletion API and return its text. Errors are raised to the caller.
 
-    def chat(self, user_input, docs):
+        Identical requests in flight at the same time (the same question with the
+        same history and context) share one completion.
+        """
+        with span("completion"):
+            return self.client.complete(self.model, messages, lane="chat", temperature=0.1)
+
+    def chat(self, user_input, docs, cache_key=None, session_id=DEFAULT_SESSION):
         """
         Generate a response from the chatbot based on user input and document context.
 
         - **user_input**: The input text from the user.
         - **docs**: Contextual documents related to the user query.
+        - **cache_key**: Answer-cache key to store a successful answer under.
+        - **session_id**: Conversation the question belongs to.
 
         Returns a dictionary containing the chatbot's response message.
         """
         try:
-            delimiter = "####"  # Delimiter used to separate sections in the context
-
-            # Create the initial messages for the chat history
-            messages = [{"role": "system", "content": system_prompt}]
-            context = f'''Query:
-    {delimiter} {user_input} {delimiter}
-
-    context:
-    {delimiter} {docs} {delimiter}
-    '''
-            
-            # Maintain a rolling history of the last 5 messages
-            if len(self.chat_history) > 5:
-                self.chat_history = self.chat_history[-4:]
-            messages += self.chat_history
-            # Add the user query to the messages
-            messages.append({'role': 'user', 'content': context})
-            print(messages)
-            # Generate a response using OpenAI's ChatCompletion API
-            response = openai.ChatCompletion.create(
-                engine=self.model,
-                messages=messages,
-                temperature=0.1
-            )
-            
-            # Update chat history with the user input and the assistant's response
-            self.chat_history.append({"role": "user", "content": user_input})
-            self.chat_history.append({"role": "assistant", "content": response.choices[0]['message']['content']})
+            messages = self.build_messages(user_input, docs, session_id)
+            answer = self.complete(messages)
+            self.update_history(user_input, answer, session_id)
+            if cache_key is not None:
+                self.answer_cache.put(cache_key, answer)
 
             # Return the chatbot's response
-            return {"message": response.choices[0]['message']['content']}
+            return {"message": answer}
         except Exception as e:
             # Print any error that occurs and return it in the response
             print(f"Error: {e}")
             return {"message": str(e)}
 
-    def get_bot_response(self, user_input):
+    def chat_stream(self, user_input, docs, cache_key=None, session_id=DEFAULT_SESSION):
+        """
+        Stream a response from the chatbot based on user input and document context.
+
+        - **user_input**: The input text from the user.
+        - **docs**: Contextual documents related to the user query.
+        - **cache_key**: Answer-cache key to store the completed answer under.
+        - **session_id**: Conversation the question belongs to.
+
+        Yields the response text piece by piece as the model generates it. The
+        chat history is updated once the stream has finished.
+        """
+        try:
+            messages = self.build_messages(user_input, docs, session_id)
+            response = self.client.stream(self.model, messages, lane="chat", temperature=0.1)
+            answer = []
+            # Only time spent waiting on the model counts, not time the caller spends handling each token
+            for chunk in timed_iter("completion", response):
+                if not chunk.choices:
+                    continue  # Azure sends a content-filter-only chunk first
+                token = chunk.choices[0].get('delta', {}).get('content')
+                if token:
+                    answer.append(token)
+                    yield token
+            answer = "".join(answer)
+            self.update_history(user_input, answer, session_id)
+            if cache_key is not None:
+                self.answer_cache.put(cache_key, answer)
+        except Exception as e:
+            # Print any error that occurs and send it as the final piece of the response
+            print(f"Error: {e}")
+            yield str(e)
+
+    def get_bot_response(self, user_input, session_id=DEFAULT_SESSION, **search_params):
         """
         Retrieve a response from the chatbot based on user input.
 
         - **user_input**: The input text from the user.
+        - **session_id**: Conversation the question belongs to; each session has its own history.
+        - **search_params**: Per-request search settings (`k`, `min_similarity`, `mode`, `min_bm25`).
 
         Returns the chatbot's response by performing a search and generating a response.
         """
-        # Initialize the Searching class
-        search = Searching(self.api_key, self.api_type, self.api_version, self.api_base,self.embed_model)
+        # Answer repeated questions from the cache without searching or calling the model
+        cache_key = self.answer_key(user_input, session_id, search_params)
+        cached = self.answer_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            self.update_history(user_input, cached, session_id)
+            return {"message": cached}
+
         # Perform a search to get relevant documents
-        docs = search.searching(user_input)
+        docs = self.search.searching(user_input, **search_params)
         
         # Get the chatbot's response based on the search results and user input
-        response = self.chat(user_input, docs)
+        response = self.chat(user_input, docs, cache_key, session_id)
         
         return response
+
+    def get_bot_response_stream(self, user_input, session_id=DEFAULT_SESSION, **search_params):
+        """
+        Streaming variant of `get_bot_response`.
+
+        - **user_input**: The input text from the user.
+        - **session_id**: Conversation the question belongs to; each session has its own history.
+        - **search_params**: Per-request search settings (`k`, `min_similarity`, `mode`, `min_bm25`).
+
+        Yields the chatbot's response text as it is generated.
+        """
+        cache_key = self.answer_key(user_input, session_id, search_params)
+        cached = self.answer_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            self.update_history(user_input, cached, session_id)
+            yield cached
+            return
+
+        docs = self.search.searching(user_input, **search_params)
+        yield from self.chat_stream(user_input, docs, cache_key, session_id)
+
+    def get_bot_responses(self, questions, concurrency=None, **search_params):
+        """
+        Answer a batch of independent questions.
+
+        - **questions**: List of question texts. Each is answered without chat history.
+        - **concurrency**: Maximum number of completion requests in flight.
+        - **search_params**: Search settings applied to every question (`k`, `min_similarity`, `mode`, `min_bm25`).
+
+        All questions are embedded in one request and searched with a single
+        matrix FAISS search; the completions are then sent concurrently. If the
+        batched search fails, each question is searched on its own, so one bad
+        question only fails itself. Returns a list aligned with `questions` of
+        dicts holding either `message` or `error`.
+        """
+        try:
+            contexts = self.search.search_many(questions, **search_params)
+        except Exception as e:
+            print(f"Error: batched search failed, searching each question on its own: {e}")
+            contexts = []
+            for question in questions:
+                try:
+                    contexts.append(self.search.search_many([question], **search_params)[0])
+                except Exception as e:
+                    print(f"Error: {e}")
+                    contexts.append(e)
+
+        def answer(item):
+            question, docs = item
+            if isinstance(docs, Exception):
+                return {"question": question, "error": str(docs)}
+            try:
+                cache_key = self.answer_key(question, None, search_params)
+                cached = self.answer_cache.get(cache_key) if cache_key is not None else None
+                if cached is None:
+                    cached = self.complete(self.build_messages(question, docs, None))
+                    if cache_key is not None:
+                        self.answer_cache.put(cache_key, cached)
+                return {"question": question, "message": cached}
+            except Exception as e:
+                print(f"Error: {e}")
+                return {"question": question, "error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=concurrency or batch_concurrency) as executor:
+            return list(executor.map(answer, zip(questions, contexts)))
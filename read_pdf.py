@@ -1,7 +1,101 @@
 import fitz  # PyMuPDF
-import json
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from config import pdf_workers, pdf_pages_per_task, pdf_parallel_min_pages
+
+def extract_page_range(path, start, end):
+    """
+    Worker task: open the PDF at `path` and return the text of pages `start` to `end - 1`.
+
+    Runs in a separate process, so each worker opens the document itself.
+    """
+    with fitz.open(path) as pdf_document:
+        return [pdf_document.load_page(page_num).get_text() for page_num in range(start, end)]
 
 class PDFReader:
+    def __init__(self, workers=pdf_workers, pages_per_task=pdf_pages_per_task):
+        """
+        - **workers**: Number of processes used by `iter_pages_parallel`.
+        - **pages_per_task**: Number of consecutive pages each worker task extracts.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+
+    def spool(self, uploaded_file):
+        """
+        Copy an uploaded file to a temporary file on disk in fixed-size blocks and return its path.
+        """
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spooled:
+            shutil.copyfileobj(uploaded_file, spooled, 1024 * 1024)
+            return spooled.name
+
+    def file_sha256(self, path):
+        """
+        Return the SHA-256 hex digest of the file at `path`, read in fixed-size blocks.
+        """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def iter_pages_parallel(self, uploaded_file):
+        """
+        Extract text from a PDF file across a process pool, yielding pages in order.
+
+        - **uploaded_file**: A file-like object representing the PDF file to extract text from.
+
+        The upload is spooled to a temporary file instead of being read into
+        memory and then read with `iter_file_pages`. Yields (page_number, text)
+        pairs with 1-based page numbers.
+        """
+        path = self.spool(uploaded_file)
+        try:
+            yield from self.iter_file_pages(path)
+        finally:
+            os.remove(path)
+
+    def iter_file_pages(self, path, first_page=1):
+        """
+        Extract text from the PDF file at `path` across a process pool, yielding pages in order.
+
+        Page ranges are handed to worker processes, with at most two ranges per
+        worker in flight, so memory stays bounded on large manuals. Small
+        documents are extracted in-process. Yields (page_number, text) pairs
+        with 1-based page numbers, starting at `first_page` (used to resume an
+        interrupted upload).
+        """
+        with fitz.open(path) as pdf_document:
+            page_count = len(pdf_document)
+            if self.workers <= 1 or page_count - first_page + 1 < pdf_parallel_min_pages:
+                for page_num in range(first_page - 1, page_count):
+                    yield page_num + 1, pdf_document.load_page(page_num).get_text()
+                return
+
+        # Spawned, not forked: this runs on a prefetch thread of a multithreaded server, and a forked child
+        # could inherit a lock another thread was holding and deadlock on it
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            pending = deque()
+            for start in range(first_page - 1, page_count, self.pages_per_task):
+                end = min(start + self.pages_per_task, page_count)
+                pending.append((start, executor.submit(extract_page_range, path, start, end)))
+                if len(pending) >= 2 * self.workers:
+                    start, future = pending.popleft()
+                    for offset, page_text in enumerate(future.result()):
+                        yield start + offset + 1, page_text
+            while pending:
+                start, future = pending.popleft()
+                for offset, page_text in enumerate(future.result()):
+                    yield start + offset + 1, page_text
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def extract_text_from_pdf(self, uploaded_file):
         """
         Extracts text from a PDF file.
@@ -16,16 +110,9 @@ class PDFReader:
         message = "fail"  # Default message indicating failure
 
         try:
-            # Open the PDF file from the uploaded BytesIO object
-            pdf_document = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-
-            # Iterate through all the pages in the PDF document
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)  # Load the page
-                text.append(page.get_text())  # Extract and store the text from the page
-
-            # Close the PDF document
-            pdf_document.close()
+            # Extract and store the text from every page
+            for _, page_text in self.iter_pages_parallel(uploaded_file):
+                text.append(page_text)
 
             # Update the message to indicate successful extraction if text was found
             if len(text) != 0:
@@ -37,25 +124,3 @@ class PDFReader:
             # Print any error that occurs during the extraction process
             print(f"An error occurred: {e}")
             return text, message  # Return the empty text list and failure message
-        
-    def pdf_add(self,name):
-        try:
-            try:
-                # Read data from the JSON file
-                with open('pdf_names.json', 'r') as f:
-                    data = json.load(f)
-                # Append a new item to the list
-                data.append(name)
-            except:
-                print("This first PDF")
-                data=[name]
-
-            # Write the list to a JSON file
-            with open('pdf_names.json', 'w') as f:
-                json.dump(data,f)
-            return "done"
-        except Exception as e:
-            print(f"Error: {e}")
-            return "fail"
-
-        
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+
+class DocumentRegistry:
+    def __init__(self, path="pdf_names.json"):
+        """
+        Initialize the registry of indexed documents, stored as a JSON object keyed by document name.
+
+        - **path**: JSON file holding the registry. The older format, a plain list
+          of names that could contain duplicates, is converted on first load.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            # Old format: list of names, possibly with duplicates
+            return {name: {} for name in data}
+        return data
+
+    def _save(self, documents):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(documents, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, name, **details):
+        """
+        Register a document, replacing any existing entry with the same name.
+
+        - **details**: Extra fields to record, e.g. `sha256` of the file and the number of `chunks`.
+        """
+        with self._lock:
+            documents = self._load()
+            documents[name] = dict(details, added_at=time.time())
+            self._save(documents)
+
+    def remove(self, name):
+        """
+        Remove a document from the registry. Returns False if it was not registered.
+        """
+        with self._lock:
+            documents = self._load()
+            if name not in documents:
+                return False
+            del documents[name]
+            self._save(documents)
+            return True
+
+    def get(self, name):
+        """
+        Return the registry entry for `name`, or None.
+        """
+        with self._lock:
+            return self._load().get(name)
+
+    def documents(self):
+        """
+        Return every registry entry, keyed by document name.
+        """
+        with self._lock:
+            return self._load()
+
+    def names(self):
+        """
+        Return the names of every registered document.
+        """
+        return list(self.documents())
+
+    def find_sha256(self, sha256):
+        """
+        Return the name of a registered document whose file had this SHA-256 digest, or None.
+        """
+        for name, details in self.documents().items():
+            if details.get("sha256") == sha256:
+                return name
+        return None
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def clear(self):
+        """
+        Remove every document from the registry.
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
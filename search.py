@@ -1,7 +1,30 @@
 import openai
 import numpy as np
 import faiss
-import json
+import os
+import threading
+from chunk_store import ChunkStore
+from embeddings import get_embedder
+from vector_index import is_exact, is_id_mapped, normalize_rows, read_index_shared, set_search_params
+from checkpoint import LoggedIndex, read_generation
+from cache import TTLCache, normalize_text
+from context import ContextBuilder
+from metrics import span
+from config import chunk_store_path, search_nprobe, search_ef, query_cache_size, query_cache_ttl
+from config import search_mode, search_k, search_min_similarity, search_min_bm25, search_candidates, search_rerank, rrf_k
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked lists of ids into one, scoring each id by the sum of 1 / (k + rank).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
 
 class Searching:
     def __init__(self,api_key, api_type, api_version, api_base,embed_model):
@@ -13,34 +36,206 @@ class Searching:
         openai.api_base = api_base
         openai.api_version = api_version
         self.embed_model=embed_model
+        self.embedder = get_embedder(embed_model)  # Shared with the indexer, selected by EMBED_PROVIDER
+        self.index_path = "sample_index.index"
+        self.store = ChunkStore(chunk_store_path, read_only=True)  # The indexer imports legacy data and does all writes
+        self.indexer = None  # FAISS index kept resident between queries
+        self.generation = None  # Generation of the index checkpoint currently loaded
+        self.applied_seq = 0  # Last logged index change applied on top of that checkpoint
+        self.nprobe = search_nprobe  # IVF lists visited per query
+        self.ef_search = search_ef  # HNSW candidate list size per query
+        self.rerank = search_rerank  # Candidates re-scored at full precision, as a multiple of k
+        self._lock = threading.Lock()
+        self.query_cache = TTLCache(query_cache_size, query_cache_ttl)  # Question embeddings by normalized text
+        self.context = ContextBuilder()  # Packs the retrieved chunks into the prompt's token budget
+
+    def current_generation(self):
+        """
+        Return the generation of the index checkpoint on disk, or None if there is none.
+        """
+        return read_generation(self.index_path)
 
-    def load_data(self):
+    def refresh(self):
         """
-        Load data from a JSON file.
+        Bring the resident index up to date with the latest checkpoint and the changes logged since.
 
-        Returns:
-        - A list of documents loaded from 'sample_data.json'.
+        A new checkpoint is memory-mapped read-only, so every worker process
+        serving the same file shares one copy in the page cache. Changes logged
+        after it are applied to a small in-memory overlay. Either way the new
+        index is built aside and swapped in, so queries already running are
+        unaffected. A legacy index file (no id map, L2 distances) is refused until
+        the writer converts it. Chunks are committed before their changes are logged, so every
+        id the index returns is already readable.
         """
-        with open('sample_data.json', 'r') as file:
-            data = json.load(file)  # Load data from the JSON file
-        return data
-   
+        generation = self.current_generation()
+        if generation == self.generation and (self.indexer is None or self.store.last_seq() <= self.applied_seq):
+            return
+        with self._lock:
+            generation = self.current_generation()
+            indexer = self.indexer
+            if generation != self.generation:
+                indexer = None
+                # Read before the file: the file is replaced before the checkpoint is recorded
+                seq = self.store.checkpoint_seq()
+                if os.path.exists(self.index_path):
+                    try:
+                        base = read_index_shared(self.index_path)
+                        set_search_params(base, self.nprobe, self.ef_search)
+                    except Exception as e:
+                        print(f"Error reloading index: {e}")
+                        return
+                    if not is_id_mapped(base) or base.metric_type != faiss.METRIC_INNER_PRODUCT:
+                        # Its scores are L2 distances and its ids vector positions; wait for the writer to convert it
+                        print("Error: index file predates id-mapped cosine indexes; run TextIndexing.upgrade_index to convert it")
+                        self.indexer, self.generation, self.applied_seq = None, generation, 0
+                        return
+                    indexer = LoggedIndex(base, seq)
+            if indexer is not None:
+                try:
+                    indexer = indexer.apply(self.store)
+                except Exception as e:
+                    print(f"Error replaying index log: {e}")
+                    return
+            self.indexer, self.generation = indexer, generation
+            self.applied_seq = indexer.seq if indexer is not None else 0
+
     def question_embedding(self, question):
         """
-        Create an embedding vector for the given question using OpenAI's API.
+        Create an embedding vector for the given question with the configured embedding provider.
+
+        Vectors are cached by normalized question text, so a repeated question
+        skips the API round trip.
 
         - **question**: The input text to be converted into an embedding.
 
         Returns:
         - A vector representation of the question.
         """
-        query_vector = openai.Embedding.create(
-            input=question,
-            engine=self.embed_model
-        )["data"][0]["embedding"]  # Extract the embedding vector from the response
+        key = (self.embedder.name, normalize_text(question))
+        query_vector = self.query_cache.get(key)
+        if query_vector is None:
+            with span("query_embedding", items=1):
+                query_vector = self.embedder.embed([question])[0]
+            self.query_cache.put(key, query_vector)
         return query_vector
     
-    def question_answering_model(self, query_vector):
+    def question_embeddings(self, questions):
+        """
+        Create embedding vectors for several questions, embedding every uncached question in one provider call.
+
+        Returns a list of vectors aligned with `questions`.
+        """
+        keys = [(self.embedder.name, normalize_text(question)) for question in questions]
+        vectors = [self.query_cache.get(key) for key in keys]
+        # One request slot per distinct uncached question, embedding its first spelling
+        originals = {}
+        for key, question, vector in zip(keys, questions, vectors):
+            if vector is None:
+                originals.setdefault(key, question)
+        missing = list(originals)
+        fetched = {}
+        if missing:
+            with span("query_embedding", items=len(missing)):
+                embeddings = self.embedder.embed([originals[key] for key in missing])
+            for key, vector in zip(missing, embeddings):
+                fetched[key] = vector
+                self.query_cache.put(key, vector)
+        return [vector if vector is not None else fetched[key] for key, vector in zip(keys, vectors)]
+
+    def check_dimension(self, indexer):
+        """
+        Raise a ValueError if the index was built with a different embedding model than the one configured.
+        """
+        if indexer.d != self.embedder.dimension:
+            raise ValueError(
+                f"Index holds {indexer.d}-dimensional vectors but {self.embedder.name} returns {self.embedder.dimension}"
+            )
+
+    def vector_search(self, query_vector, k=None, min_similarity=None):
+        """
+        Use FAISS to find the chunks most similar to the query vector.
+
+        - **query_vector**: The embedding vector of the question.
+        - **k**: Number of neighbours to retrieve.
+        - **min_similarity**: Hits with a lower cosine similarity are dropped.
+
+        Returns a list of (id, similarity) pairs, most similar first.
+        """
+        return self.vector_search_many([query_vector], k, min_similarity)[0]
+
+    def vector_search_many(self, query_vectors, k=None, min_similarity=None):
+        """
+        Search FAISS for several query vectors with a single matrix search.
+
+        Unless the index scores exactly (flat, full vectors), `rerank` times `k`
+        candidates are taken from it and re-scored against the full stored vectors.
+
+        Returns one list of (id, similarity) pairs per query, most similar first.
+        """
+        k = k or search_k
+        min_similarity = search_min_similarity if min_similarity is None else min_similarity
+        self.refresh()  # Pick up new uploads without reloading on every query
+        indexer = self.indexer
+        if indexer is None or len(query_vectors) == 0:
+            return [[] for _ in query_vectors]
+        self.check_dimension(indexer)
+        matrix = normalize_rows(np.reshape(query_vectors, (len(query_vectors), self.embedder.dimension)))
+        base = getattr(indexer, "base", indexer)
+        rerank = self.rerank > 1 and not is_exact(base)
+        with span("vector_search", items=len(matrix)):
+            scores, indices = indexer.search(matrix, k=k * self.rerank if rerank else k)
+        if rerank:
+            hits = self.rerank_hits(matrix, indices, k)
+        else:
+            hits = [
+                [(int(index), float(score)) for index, score in zip(row_indices, row_scores) if index >= 0]
+                for row_scores, row_indices in zip(scores, indices)
+            ]
+        return [[(chunk_id, score) for chunk_id, score in row if score >= min_similarity] for row in hits]
+
+    def rerank_hits(self, queries, indices, k):
+        """
+        Re-score the candidate ids of each (normalized) query by exact cosine similarity with the stored vectors.
+
+        Returns one list of up to `k` (id, similarity) pairs per query, most similar first.
+        """
+        results = []
+        with span("rerank", items=len(queries)):
+            for query, row in zip(queries, indices):
+                ids, vectors = self.store.get_vectors(row[row >= 0])
+                if not len(ids):
+                    results.append([])
+                    continue
+                similarities = normalize_rows(vectors) @ query
+                order = np.argsort(-similarities, kind="stable")[:k]
+                results.append([(int(ids[i]), float(similarities[i])) for i in order])
+        return results
+
+    def lexical_search(self, text, k=None, min_score=None):
+        """
+        Rank chunks against the question text with BM25, without an embedding call.
+
+        Returns a list of (id, score) pairs, best first, keeping scores of at least `min_score`.
+        """
+        min_score = search_min_bm25 if min_score is None else min_score
+        with span("lexical_search", items=1):
+            hits = self.store.lexical_search(text, k or search_k)
+        return [(chunk_id, score) for chunk_id, score in hits if score >= min_score]
+
+    def documents(self, ids):
+        """
+        Fetch the chunks for the given ids (best first) and assemble them into one context string.
+
+        Passages are cited by source and page, overlapping and repeated text is
+        dropped and the result fits the context token budget (see `ContextBuilder`).
+        Returns "" when no chunk was found.
+        """
+        with span("chunk_lookup", items=len(ids)):
+            records = self.store.get_many(ids)
+        with span("context"):
+            return self.context.build(records)
+
+    def question_answering_model(self, query_vector, k=None, min_similarity=None):
         """
         Use FAISS to find the most relevant documents based on the query vector.
 
@@ -50,38 +245,86 @@ class Searching:
         - A string containing relevant documents based on the search results.
         """
         try:
-            embedd = np.array(query_vector)  # Convert the query vector to a NumPy array
-            embed_reshaped = embedd.reshape(1, 1536)  # Reshape the vector to match FAISS index input
-            indexer = faiss.read_index("sample_index.index")  # Load the FAISS index
-            distances, indices = indexer.search(embed_reshaped, k=2)  # Perform the search
-            relevant_documents = ''
-            print("Distances Between Context Vectors and Query Vectors:",distances[0],"Indexes:", indices[0])  # Print distances and indices for debugging
-            paragraph = self.load_data()  # Load documents from the JSON file
-            for i, index in enumerate(indices[0]):
-                # Append documents to the result if their distance is below the threshold
-                if (distances[0][i]) < 0.4999:
-                    document = paragraph[index]
-                    relevant_documents += (document + " ")
-            return relevant_documents
+            hits = self.vector_search(query_vector, k, min_similarity)
+            return self.documents([chunk_id for chunk_id, _ in hits])
         except Exception as e:
             # Print any errors encountered during the process
             print(f"Error: {e}")
             return ""
-    
-    def searching(self, text):
+
+    def retrieve(self, text, k=None, min_similarity=None, mode=None, min_bm25=None):
+        """
+        Return the ids of the chunks most relevant to `text`, best first.
+
+        - **k**: Number of chunks to return.
+        - **min_similarity**: Vector hits less similar than this are dropped.
+        - **mode**: "vector", "lexical" or "hybrid". Hybrid retrieves `search_candidates`
+          times `k` candidates from each retriever and fuses them with reciprocal rank fusion.
+          Lexical mode never calls the embedding API.
+        - **min_bm25**: Lexical hits scoring below this are dropped.
+        """
+        k = k or search_k
+        mode = mode or search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode == "lexical":
+            return [chunk_id for chunk_id, _ in self.lexical_search(text, k, min_bm25)]
+
+        query_vector = self.question_embedding(text)  # Get the embedding vector for the text
+        if mode == "vector":
+            return [chunk_id for chunk_id, _ in self.vector_search(query_vector, k, min_similarity)]
+
+        candidates = k * search_candidates
+        vector_ids = [chunk_id for chunk_id, _ in self.vector_search(query_vector, candidates, min_similarity)]
+        lexical_ids = [chunk_id for chunk_id, _ in self.lexical_search(text, candidates, min_bm25)]
+        return reciprocal_rank_fusion([vector_ids, lexical_ids], rrf_k)[:k]
+
+    def retrieve_many(self, texts, k=None, min_similarity=None, mode=None, min_bm25=None):
+        """
+        Batch variant of `retrieve`: one embedding round trip and one matrix FAISS search for all questions.
+
+        Returns a list of id lists aligned with `texts`.
+        """
+        k = k or search_k
+        mode = mode or search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode == "lexical":
+            return [[chunk_id for chunk_id, _ in self.lexical_search(text, k, min_bm25)] for text in texts]
+
+        query_vectors = self.question_embeddings(texts)
+        if mode == "vector":
+            return [[chunk_id for chunk_id, _ in hits] for hits in self.vector_search_many(query_vectors, k, min_similarity)]
+
+        candidates = k * search_candidates
+        results = []
+        for text, hits in zip(texts, self.vector_search_many(query_vectors, candidates, min_similarity)):
+            lexical_ids = [chunk_id for chunk_id, _ in self.lexical_search(text, candidates, min_bm25)]
+            results.append(reciprocal_rank_fusion([[chunk_id for chunk_id, _ in hits], lexical_ids], rrf_k)[:k])
+        return results
+
+    def search_many(self, texts, k=None, min_similarity=None, mode=None, min_bm25=None):
+        """
+        Batch variant of `searching`.
+
+        Returns a list of context strings aligned with `texts`. Errors propagate to the caller.
+        """
+        return [self.documents(ids) for ids in self.retrieve_many(texts, k, min_similarity, mode, min_bm25)]
+
+    def searching(self, text, k=None, min_similarity=None, mode=None, min_bm25=None):
         """
         Perform the search process for the given text.
 
-        - **text**: The input text to be embedded and searched.
+        - **text**: The input text to be searched.
+        - **k**, **min_similarity**, **mode**, **min_bm25**: Per-request overrides of the
+          search settings, see `retrieve`.
 
         Returns:
-        - A string with relevant documents or "fail" if an error occurs.
+        - A string with relevant documents, or "" if none were found or an error occurs.
         """
         try:
-            query_vector = self.question_embedding(text)  # Get the embedding vector for the text
-            data = self.question_answering_model(query_vector)  # Find relevant documents
-            return data
+            return self.documents(self.retrieve(text, k, min_similarity, mode, min_bm25))  # Find relevant documents
         except Exception as e:
-            # Print any errors encountered and return "fail"
+            # Print any errors encountered and answer without context
             print(f"Error: {e}")
-            return "fail"
+            return ""
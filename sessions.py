@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from tokens import count_tokens
+
+class SessionStore:
+    def __init__(self, max_sessions=1000, history_token_budget=1500, idle_ttl=3600, path=":memory:"):
+        """
+        Initialize a per-session store of conversation history.
+
+        - **max_sessions**: Maximum number of sessions kept; the least recently used are evicted beyond this.
+        - **history_token_budget**: Maximum tokens of history kept per session; the oldest turns are dropped first.
+        - **idle_ttl**: Seconds after the last recorded turn that a session is discarded.
+        - **path**: SQLite file the histories are kept in. Worker processes given the same
+          file share every session, so a follow-up question may reach any of them. By
+          default histories are kept in this process's memory.
+
+        Together the two limits bound the space used by all histories and the
+        prompt size of every request.
+        """
+        self.max_sessions = max_sessions
+        self.history_token_budget = history_token_budget
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        # Autocommit, so each read-modify-write below runs in its own explicit transaction
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # History is a JSON list of [message, tokens] pairs
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_used REAL NOT NULL, history TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # Take the write lock up front, so concurrent turns from other processes are applied one after another
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def get(self, session_id):
+        """
+        Return the session's history as a list of chat messages.
+
+        A plain read, so questions never wait for the write lock of the database
+        uploads also write to. Sessions idle longer than `idle_ttl` read as empty,
+        and are deleted by the next `append`.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history FROM sessions WHERE session_id = ? AND last_used >= ?",
+                (session_id, time.time() - self.idle_ttl),
+            ).fetchone()
+        if row is None:
+            return []
+        return [message for message, _ in json.loads(row[0])]
+
+    def append(self, session_id, user_input, answer):
+        """
+        Record a user/assistant turn and trim the session's history to its token budget.
+        """
+        turn = [
+            [{"role": "user", "content": user_input}, count_tokens(user_input)],
+            [{"role": "assistant", "content": answer}, count_tokens(answer)],
+        ]
+        with self._transaction():
+            self._expire()
+            row = self._conn.execute("SELECT history FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            history = (json.loads(row[0]) if row is not None else []) + turn
+            total = sum(tokens for _, tokens in history)
+            # Drop whole turns from the front so a question is never kept without its answer
+            while history and total > self.history_token_budget:
+                total -= history[0][1] + history[1][1]
+                history = history[2:]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (session_id, time.time(), json.dumps(history))
+            )
+            self._conn.execute(
+                """DELETE FROM sessions WHERE session_id NOT IN
+                (SELECT session_id FROM sessions ORDER BY last_used DESC LIMIT ?)""",
+                (self.max_sessions,),
+            )
+
+    def clear(self, session_id):
+        """
+        Forget a session's history.
+        """
+        with self._transaction():
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _expire(self):
+        self._conn.execute("DELETE FROM sessions WHERE last_used < ?", (time.time() - self.idle_ttl,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
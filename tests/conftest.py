@@ -0,0 +1,69 @@
+import os
+import sys
+import fitz  # PyMuPDF
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_pdf(path, pages):
+    """
+    Write a PDF whose pages are given as a list of texts, one per page.
+    """
+    document = fitz.open()
+    for text in pages:
+        document.new_page().insert_textbox(fitz.Rect(36, 36, 560, 806), text, fontsize=8)
+    document.save(path)
+    document.close()
+    return path
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Run the test in an empty directory, where the index, chunk store, caches and registry are created.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    """
+    Local stand-in for the embedding and chat endpoints (bench/fake_openai.py), shared by every test.
+    """
+    from bench.fake_openai import FakeOpenAIServer
+
+    server = FakeOpenAIServer(dim=64).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def credentials(fake_openai):
+    return ("fake-key", "azure", "2024-02-01", fake_openai.url)
+
+
+@pytest.fixture
+def make_indexer(workdir, credentials):
+    """
+    Return a factory of TextIndexing instances working in `workdir`, without a background checkpointer.
+
+    Several instances stand in for a restarted process or for other worker processes.
+    """
+    from index import TextIndexing
+
+    def make():
+        indexer = TextIndexing(*credentials, "fake-embedding")
+        indexer.checkpoint_interval = 0
+        return indexer
+
+    return make
+
+
+def pages_about(*topics, words=40):
+    """
+    Return one page of text per topic, each made of words only that topic uses.
+    """
+    return [" ".join(f"{topic}{i}" for i in range(words)) for topic in topics]
@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(workdir):
+    from app import app
+
+    return TestClient(app)  # Without the lifespan: requests rejected by validation never reach the backend
+
+
+@pytest.mark.parametrize("body", [
+    {"questions": []},
+    {"questions": ["q"] * 101},
+    {"questions": ["q"], "concurrency": 0},
+    {"questions": ["q"], "concurrency": -1},
+])
+def test_invalid_batch_requests_are_rejected(client, body):
+    assert client.post("/chat/batch", json=body).status_code == 422
+
+
+@pytest.mark.parametrize("params", [
+    {"k": 0},
+    {"k": -1},
+    {"min_similarity": 1.5},
+    {"min_similarity": -2},
+    {"min_bm25": -1},
+    {"mode": "fuzzy"},
+])
+@pytest.mark.parametrize("path, body", [
+    ("/chat", {"user_input": "q"}),
+    ("/chat/stream", {"user_input": "q"}),
+    ("/chat/batch", {"questions": ["q"]}),
+])
+def test_invalid_search_settings_are_rejected(client, path, body, params):
+    assert client.post(path, json={**body, **params}).status_code == 422
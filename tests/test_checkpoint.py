@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from checkpoint import LoggedIndex, replay
+from chunk_store import ChunkStore
+from vector_index import base_index, build_index, index_ids, normalize_rows
+
+DIM = 8
+
+
+@pytest.fixture
+def store(workdir):
+    return ChunkStore(str(workdir / "chunks.db"))
+
+
+def vectors(n, seed=0):
+    return normalize_rows(np.random.default_rng(seed).normal(size=(n, DIM)))
+
+
+def add(store, n, seed=0):
+    data = vectors(n, seed)
+    ids = store.append([{"text": f"chunk {seed}-{i}"} for i in range(n)], vectors=data)
+    return ids, data
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_replay_applies_adds_and_deletes(store, index_type):
+    ids, _ = add(store, 10)
+    store.delete_ids(ids[:3])
+    more, _ = add(store, 4, seed=1)
+    store.delete_ids(more[-1:])
+
+    def rebuild():
+        index = build_index(index_type, DIM)
+        stored_ids, stored = store.load_vectors()
+        index.add_with_ids(normalize_rows(stored), stored_ids)
+        return index
+
+    indexer, seq = replay(build_index(index_type, DIM), store, 0, rebuild=rebuild)
+
+    assert sorted(index_ids(indexer).tolist()) == ids[3:] + more[:-1]
+    assert seq == store.last_seq()
+
+
+def test_replay_is_idempotent(store):
+    ids, _ = add(store, 5)
+    indexer, _ = replay(build_index("flat", DIM), store, 0)
+    store.delete_ids(ids[:2])
+    indexer, _ = replay(indexer, store, 0)  # From an older checkpoint than the index holds
+
+    indexer, seq = replay(indexer, store, 0)
+
+    assert sorted(index_ids(indexer).tolist()) == ids[2:]
+    assert indexer.ntotal == 3
+    assert seq == store.last_seq()
+
+
+def test_replay_after_checkpoint_recovers_unsaved_changes(store, workdir):
+    import faiss
+
+    ids, _ = add(store, 6)
+    indexer, seq = replay(build_index("flat", DIM), store, 0)
+    faiss.write_index(indexer, str(workdir / "index"))
+    store.mark_checkpoint(seq)
+    more, _ = add(store, 3, seed=1)
+    store.delete_ids(ids[:1])  # Never checkpointed: lost with the process unless replayed
+
+    recovered, _ = replay(faiss.read_index(str(workdir / "index")), store, store.checkpoint_seq())
+
+    assert sorted(index_ids(recovered).tolist()) == ids[1:] + more
+
+
+def test_logged_index_applies_changes_without_touching_the_base(store):
+    ids, data = add(store, 6)
+    base, seq = replay(build_index("flat", DIM), store, 0)
+    logged = LoggedIndex(base, seq)
+    more, more_data = add(store, 2, seed=1)
+    store.delete_ids([ids[0], more[1]])
+
+    updated = logged.apply(store)
+
+    assert base.ntotal == 6 and logged.delta is None  # The checkpoint and the old overlay are untouched
+    assert updated.ntotal == 6
+    assert updated.seq == store.last_seq()
+    _, found = updated.search(np.vstack([more_data[0], data[1]]), k=1)
+    assert found[:, 0].tolist() == [more[0], ids[1]]
+    _, found = updated.search(data[:1], k=7)
+    assert ids[0] not in found[0].tolist() and more[1] not in found[0].tolist()
+
+
+def test_logged_index_search_matches_a_rebuilt_index(store):
+    ids, _ = add(store, 20)
+    base, seq = replay(build_index("flat", DIM), store, 0)
+    add(store, 5, seed=1)
+    store.delete_ids(ids[5:10])
+    logged = LoggedIndex(base, seq).apply(store)
+    rebuilt, _ = replay(build_index("flat", DIM), store, 0)
+    queries = vectors(4, seed=2)
+
+    expected_scores, expected_ids = rebuilt.search(queries, 5)
+    scores, found = logged.search(queries, 5)
+
+    assert found.tolist() == expected_ids.tolist()
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_replay_deletes_from_an_ivf_index_keep_ids_matched_to_vectors(store):
+    ids, data = add(store, 100)
+    indexer = build_index("ivf_flat", DIM, data)
+    indexer.add_with_ids(data, np.array(ids, dtype=np.int64))
+    store.delete_ids(ids[:10])
+
+    # Without a rebuild the deletes wait for the next checkpoint, and the index is left intact
+    indexer, _ = replay(indexer, store, store.last_seq() - 10)
+
+    base_index(indexer).nprobe = base_index(indexer).nlist
+    _, found = indexer.search(data[10:], 1)
+    assert found[:, 0].tolist() == ids[10:]
@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+from conftest import ROOT
+
+
+def test_workers_starting_together_import_the_legacy_json_once(workdir):
+    chunks = [f"legacy chunk {i}" for i in range(2000)]
+    (workdir / "sample_data.json").write_text(json.dumps(chunks))
+    script = (
+        "from chunk_store import ChunkStore\n"
+        "from process_lock import ProcessLock\n"
+        "ChunkStore('chunks.db', legacy_json_path='sample_data.json', write_lock=ProcessLock('index.lock'))\n"
+    )
+
+    workers = [
+        subprocess.Popen([sys.executable, "-c", script], cwd=workdir, env={**os.environ, "PYTHONPATH": ROOT},
+                         stderr=subprocess.PIPE, text=True)
+        for _ in range(4)
+    ]
+
+    for worker in workers:
+        assert worker.wait(timeout=60) == 0, worker.stderr.read()
+    from chunk_store import ChunkStore
+
+    store = ChunkStore(str(workdir / "chunks.db"))
+    assert len(store) == len(chunks)
+    assert [store.get(i)["text"] for i in (0, len(chunks) - 1)] == [chunks[0], chunks[-1]]
+    assert not (workdir / "sample_data.json").exists()
@@ -0,0 +1,60 @@
+from chunker import batched_by_page, chunk_pages
+from tokens import count_tokens
+
+
+def words(n, prefix="w"):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def test_chunks_stay_within_the_token_budget_and_overlap():
+    chunks = list(chunk_pages([words(300)], max_tokens=50, overlap_tokens=10))
+
+    assert len(chunks) > 1
+    assert all(sum(count_tokens(" " + word) for word in chunk["text"].split()) <= 50 for chunk in chunks)
+    for first, second in zip(chunks, chunks[1:]):
+        first, second = first["text"].split(), second["text"].split()
+        shared = next(size for size in range(len(second), 0, -1) if first[-size:] == second[:size])
+        assert 0 < sum(count_tokens(" " + word) for word in second[:shared]) <= 10
+    assert [chunk["chunk"] for chunk in chunks] == list(range(len(chunks)))
+
+
+def test_chunks_never_span_pages():
+    pages = [words(30, "a"), "tiny", words(30, "b")]
+
+    chunks = list(chunk_pages(pages, max_tokens=1000, overlap_tokens=10))
+
+    assert [(chunk["page"], chunk["text"].split()[0]) for chunk in chunks] == [(1, "a0"), (2, "tiny"), (3, "b0")]
+
+
+def test_editing_one_page_keeps_the_chunks_of_the_others():
+    pages = [words(200, f"p{page}x") for page in range(5)]
+    edited = ["inserted " + pages[0]] + pages[1:]
+
+    before = {chunk["text"] for chunk in chunk_pages(pages, max_tokens=60, overlap_tokens=10)}
+    after = [chunk for chunk in chunk_pages(edited, max_tokens=60, overlap_tokens=10)]
+
+    assert {chunk["text"] for chunk in after if chunk["page"] > 1} <= before
+
+
+def test_resumed_chunking_matches_an_uninterrupted_run():
+    pages = [words(120, f"p{page}x") for page in range(1, 7)]
+    full = list(chunk_pages(pages, max_tokens=50, overlap_tokens=10))
+    done = sum(1 for chunk in full if chunk["page"] <= 3)
+
+    resumed = list(chunk_pages([(page, text) for page, text in enumerate(pages, 1) if page > 3], 50, 10, first_chunk=done))
+
+    assert resumed == full[done:]
+
+
+def test_empty_pages_yield_no_chunks():
+    assert list(chunk_pages(["", "   ", ""])) == []
+
+
+def test_batched_by_page_cuts_only_between_pages():
+    chunks = [{"page": page} for page in (1, 1, 1, 2, 2, 3, 4, 4, 4, 4)]
+
+    batches = list(batched_by_page(chunks, 2))
+
+    assert [[chunk["page"] for chunk in batch] for batch in batches] == [[1, 1, 1], [2, 2], [3, 4, 4, 4, 4]]
+    for batch, following in zip(batches, batches[1:]):
+        assert following[0]["page"] > batch[-1]["page"]
@@ -0,0 +1,49 @@
+from context import ContextBuilder, overlap
+from tokens import count_tokens
+
+
+def record(text, source="manual.pdf", page=1):
+    return {"text": text, "source": source, "page": page}
+
+
+def words(n, prefix="w"):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def test_overlap_ignores_short_coincidences():
+    assert overlap("a b c d e f g".split(), "d e f g h".split()) == 0  # Shorter than MIN_OVERLAP_WORDS
+    assert overlap("a b c d e f g".split(), "c d e f g h".split()) == 5
+
+
+def test_passages_are_cited_and_overlap_is_trimmed():
+    first = words(30)
+    second = " ".join(first.split()[-10:] + words(20, "x").split())
+
+    passages = ContextBuilder(token_budget=1000).passages([record(first), record(second, page=2)])
+
+    assert passages[0] == {"text": first, "citation": "manual.pdf, page 1"}
+    assert passages[1] == {"text": words(20, "x"), "citation": "manual.pdf, page 2"}
+
+
+def test_repeated_passages_are_dropped():
+    text = words(40)
+
+    passages = ContextBuilder(token_budget=1000).passages(
+        [record(text), record(text.upper(), source="copy.pdf"), None, record(words(40, "y"))]
+    )
+
+    assert [passage["text"] for passage in passages] == [text, words(40, "y")]
+
+
+def test_context_fits_the_token_budget():
+    builder = ContextBuilder(token_budget=60)
+
+    context = builder.build([record(words(100)), record(words(100, "y"), page=2)])
+
+    assert count_tokens(context) <= 60
+    assert context.startswith("[1] (manual.pdf, page 1) w0 w1")
+    assert "[2]" not in context
+
+
+def test_no_records_build_an_empty_context():
+    assert ContextBuilder().build([]) == ""
@@ -0,0 +1,271 @@
+import pytest
+import index as index_module
+from conftest import pages_about
+from vector_index import index_ids
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(index_module, "ingest_batch_chunks", 2)
+
+
+def texts(indexer, name):
+    return sorted(record["text"] for record in indexer.store.get_many(indexer.store.document_ids(name)))
+
+
+def assert_index_matches_store(make_indexer):
+    """
+    A freshly started indexer, replaying the checkpoint and the log, holds exactly the stored vectors.
+    """
+    restarted = make_indexer()
+    with restarted._write_lock:
+        indexer = restarted.load_or_create_indexer()
+    stored_ids, _ = restarted.store.load_vectors()
+    assert sorted(index_ids(indexer).tolist()) == stored_ids.tolist()
+
+
+def test_add_document_resumes_after_a_failed_batch(make_indexer, small_batches):
+    indexer = make_indexer()
+    pages = pages_about("alpha", "beta", "gamma", "delta", "epsilon", "zeta")
+    embed = indexer.cached_embeddings_creation
+    embedded = []
+
+    def failing_second_batch(chunks):
+        chunks = list(chunks)
+        if embedded:
+            raise RuntimeError("embedding service unavailable")
+        embedded.append(chunks)
+        return embed(chunks)
+
+    indexer.cached_embeddings_creation = failing_second_batch
+    assert indexer.add_document("manual.pdf", pages, sha256="abc") == "fail"
+    assert indexer.store.ingest_progress("manual.pdf")["last_page"] == 2
+    assert "manual.pdf" not in indexer.registry
+
+    def recording(chunks):
+        chunks = list(chunks)
+        embedded.append(chunks)
+        return embed(chunks)
+
+    indexer.cached_embeddings_creation = recording
+    assert indexer.add_document("manual.pdf", pages, sha256="abc") == "done"
+
+    retried = [text for batch in embedded[1:] for text in batch]
+    assert sorted(retried) == sorted(pages[2:])  # Pages committed before the failure are not embedded again
+    records = indexer.store.get_many(indexer.store.document_ids("manual.pdf"))
+    assert [record["chunk"] for record in records] == list(range(6))
+    assert [record["page"] for record in records] == list(range(1, 7))
+    assert indexer.store.ingest_progress("manual.pdf") is None
+    assert indexer.registry.documents()["manual.pdf"]["chunks"] == 6
+    assert_index_matches_store(make_indexer)
+
+
+def test_failed_upload_of_other_content_is_discarded(make_indexer, small_batches):
+    indexer = make_indexer()
+    embed = indexer.cached_embeddings_creation
+    calls = []
+
+    def failing_second_batch(chunks):
+        calls.append(None)
+        if len(calls) > 1:
+            raise RuntimeError("embedding service unavailable")
+        return embed(chunks)
+
+    indexer.cached_embeddings_creation = failing_second_batch
+    assert indexer.add_document("manual.pdf", pages_about("alpha", "beta", "gamma"), sha256="old") == "fail"
+    indexer.cached_embeddings_creation = embed
+
+    assert indexer.add_document("manual.pdf", pages_about("delta", "epsilon"), sha256="new") == "done"
+
+    assert texts(indexer, "manual.pdf") == sorted(pages_about("delta", "epsilon"))
+    assert len(indexer.store) == 2
+    assert_index_matches_store(make_indexer)
+
+
+def test_restart_recovers_changes_that_were_never_checkpointed(make_indexer, credentials):
+    from search import Searching
+
+    indexer = make_indexer()
+    indexer.checkpoint_ops = 10 ** 6
+    assert indexer.add_document("first.pdf", pages_about("alpha")) == "done"  # Writes the first index file
+    assert indexer.add_document("second.pdf", pages_about("beta")) == "done"  # Only logged
+    assert indexer.store.last_seq() > indexer.store.checkpoint_seq()
+
+    assert_index_matches_store(make_indexer)
+    search = Searching(*credentials, "fake-embedding")
+    hits = search.vector_search(search.question_embedding(pages_about("beta")[0]), k=1)
+    assert [search.store.get(chunk_id)["source"] for chunk_id, _ in hits] == ["second.pdf"]
+
+
+def test_duplicates_are_skipped_and_handed_over_on_delete(make_indexer):
+    indexer = make_indexer()
+    assert indexer.add_document("a.pdf", pages_about("alpha", "beta")) == "done"
+    assert indexer.add_document("b.pdf", pages_about("beta", "gamma")) == "done"
+
+    assert indexer.registry.documents()["b.pdf"]["duplicates"] == 1
+    assert texts(indexer, "b.pdf") == pages_about("gamma")
+    assert len(indexer.store) == 3
+
+    assert indexer.delete_document("a.pdf") == "done"
+
+    assert texts(indexer, "b.pdf") == sorted(pages_about("beta", "gamma"))  # The shared chunk now belongs to b.pdf
+    assert indexer.store.ref_count("b.pdf") == 0
+    assert len(indexer.store) == 2
+    assert_index_matches_store(make_indexer)
+
+
+def test_replace_hands_over_chunks_other_documents_share(make_indexer):
+    indexer = make_indexer()
+    assert indexer.add_document("a.pdf", pages_about("alpha", "beta")) == "done"
+    assert indexer.add_document("b.pdf", pages_about("beta", "gamma")) == "done"
+
+    assert indexer.add_document("a.pdf", pages_about("alpha", "delta")) == "done"
+
+    assert texts(indexer, "a.pdf") == sorted(pages_about("alpha", "delta"))
+    assert texts(indexer, "b.pdf") == sorted(pages_about("beta", "gamma"))
+    assert indexer.registry.documents()["a.pdf"]["chunks"] == 2
+    assert len(indexer.store) == 4
+    assert_index_matches_store(make_indexer)
+
+
+def test_replace_with_same_content_keeps_shared_chunks_once(make_indexer):
+    indexer = make_indexer()
+    assert indexer.add_document("a.pdf", pages_about("alpha", "beta")) == "done"
+    assert indexer.add_document("b.pdf", pages_about("beta")) == "done"
+
+    assert indexer.add_document("a.pdf", pages_about("alpha", "beta")) == "done"
+
+    assert texts(indexer, "a.pdf") == sorted(pages_about("alpha", "beta"))
+    assert texts(indexer, "b.pdf") == []
+    assert indexer.store.ref_count("b.pdf") == 1
+    assert len(indexer.store) == 2
+
+    assert indexer.delete_document("a.pdf") == "done"
+
+    assert texts(indexer, "b.pdf") == pages_about("beta")
+    assert len(indexer.store) == 1
+    assert_index_matches_store(make_indexer)
+
+
+def test_delete_unknown_document(make_indexer):
+    assert make_indexer().delete_document("missing.pdf") == "missing"
+
+
+def test_ingest_file_indexes_and_removes_the_spooled_file(make_indexer, workdir):
+    from conftest import make_pdf
+
+    indexer = make_indexer()
+    path = make_pdf(workdir / "upload.pdf", pages_about("alpha", "beta"))
+    stages = []
+
+    assert indexer.ingest_file(str(path), "manual.pdf", progress=lambda stage, **_: stages.append(stage), remove=True) == "done"
+
+    assert not path.exists()
+    assert stages[0] == "extracting" and stages[-1] == "indexing"
+    assert len(indexer.store.document_ids("manual.pdf")) == 2
+    assert indexer.registry.documents()["manual.pdf"]["sha256"]
+
+
+def test_writer_releases_the_index_after_each_write(make_indexer):
+    indexer = make_indexer()
+    assert indexer.add_document("first.pdf", pages_about("alpha")) == "done"
+    assert indexer.indexer is None
+
+    indexer.checkpoint_ops = 10 ** 6
+    assert indexer.add_document("second.pdf", pages_about("beta")) == "done"  # Only logged
+    assert indexer.indexer is None
+    indexer.checkpoint()  # Loads the index again to write it out
+    assert indexer.indexer is None
+    assert indexer.store.last_seq() == indexer.store.checkpoint_seq()
+    assert_index_matches_store(make_indexer)
+
+
+def test_legacy_index_is_refused_until_converted_at_startup(make_indexer, credentials, workdir):
+    import json
+    import faiss
+    import numpy as np
+    from bench.fake_openai import fake_embedding
+    from checkpoint import read_generation
+    from search import Searching
+
+    # The original format: chunks in sample_data.json, an IVF index with L2 distances and positions as ids
+    chunks = pages_about("alpha", "beta", "gamma", "delta", words=20)
+    (workdir / "sample_data.json").write_text(json.dumps(chunks))
+    vectors = np.array([fake_embedding(chunk, 64) for chunk in chunks], dtype=np.float32)
+    legacy = faiss.IndexIVFFlat(faiss.IndexFlatL2(64), 64, 1)
+    legacy.train(vectors)
+    legacy.add(vectors)
+    faiss.write_index(legacy, "sample_index.index")
+
+    indexer = make_indexer()  # Imports the legacy chunks
+    search = Searching(*credentials, "fake-embedding")
+    query = search.question_embedding(chunks[2])
+    assert search.vector_search(query, k=1, min_similarity=-1) == []
+    assert search.indexer is None  # Refused rather than misreading L2 distances as similarities
+
+    indexer.upgrade_index()
+    assert indexer.indexer is None
+    generation = read_generation("sample_index.index")
+    indexer.upgrade_index()  # Already current
+    assert read_generation("sample_index.index") == generation
+
+    hits = search.vector_search(query, k=1)
+    assert [search.store.get(chunk_id)["text"] for chunk_id, _ in hits] == [chunks[2]]
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-4)
+
+
+def test_deleting_from_an_ivf_index_keeps_the_other_documents_retrievable(make_indexer, credentials):
+    from search import Searching
+    from vector_index import index_kind
+
+    indexer = make_indexer()
+    indexer.index_type = "ivf_flat"
+    kept = pages_about(*(f"kept{i}x" for i in range(80)), words=10)
+    assert indexer.add_document("a.pdf", pages_about(*(f"gone{i}x" for i in range(20)), words=10)) == "done"
+    assert indexer.add_document("b.pdf", kept) == "done"
+
+    assert indexer.delete_document("a.pdf") == "done"
+    indexer.checkpoint()  # Readers then search the writer's index rather than the old checkpoint and the log
+
+    search = Searching(*credentials, "fake-embedding")
+    search.refresh()
+    assert not search.indexer.deleted
+    assert index_kind(search.indexer.base) == "ivf_flat"
+    for text in kept:
+        hits = search.vector_search(search.question_embedding(text), k=1)
+        assert [search.store.get(chunk_id)["text"] for chunk_id, _ in hits] == [text]
+    assert_index_matches_store(make_indexer)
+
+
+def test_revised_chunks_are_indexed_unless_near_dedup_is_enabled(make_indexer):
+    from dedup import Deduplicator
+
+    original = pages_about("alpha", words=60)
+    revised = [original[0].replace("alpha30", "changed")]
+    indexer = make_indexer()
+    assert indexer.add_document("v1.pdf", original) == "done"
+
+    assert indexer.add_document("v2.pdf", revised) == "done"
+    assert texts(indexer, "v2.pdf") == revised
+
+    indexer.dedup = Deduplicator(indexer.store, "near")
+    assert indexer.add_document("v3.pdf", [revised[0].replace("alpha40", "again")]) == "done"
+    assert texts(indexer, "v3.pdf") == []  # Skipped as a near duplicate of v2.pdf
+
+
+def test_ingest_file_reads_the_resume_point_under_the_write_lock(make_indexer, workdir, monkeypatch):
+    from conftest import make_pdf
+
+    indexer = make_indexer()
+    path = make_pdf(workdir / "upload.pdf", pages_about("alpha"))
+    resume_point = indexer.resume_point
+    locked = []
+
+    def recording_resume_point(name, sha256):
+        locked.append(indexer._writes > 0)
+        return resume_point(name, sha256)
+
+    monkeypatch.setattr(indexer, "resume_point", recording_resume_point)
+
+    assert indexer.ingest_file(str(path), "manual.pdf") == "done"
+    assert locked and all(locked)
@@ -0,0 +1,88 @@
+import threading
+import time
+from jobs import JobQueue
+
+
+def wait_for(queue, job_id, **fields):
+    for _ in range(500):
+        job = queue.get(job_id)
+        if job and all(job[key] == value for key, value in fields.items()):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {fields}: {queue.get(job_id)}")
+
+
+def test_job_status_is_visible_from_another_queue_on_the_same_file(workdir):
+    path = str(workdir / "jobs.db")
+    running, other = JobQueue(path=path), JobQueue(path=path)
+    release = threading.Event()
+
+    def job(name, progress):
+        progress("indexing", chunks=3)
+        release.wait(5)
+        return "done"
+
+    job_id = running.submit(job, "a.pdf", name="a.pdf")
+    job = wait_for(other, job_id, stage="indexing")
+    assert (job["status"], job["progress"]) == ("running", {"chunks": 3})
+
+    release.set()
+    job = wait_for(other, job_id, status="done")
+    assert (job["result"], job["name"]) == ("done", "a.pdf")
+    assert other.get("unknown") is None
+
+
+def test_failed_job_records_its_error():
+    queue = JobQueue()
+
+    def job(progress):
+        raise RuntimeError("Indexing failed")
+
+    job = wait_for(queue, queue.submit(job), status="failed")
+    assert job["error"] == "Indexing failed"
+
+
+def test_oldest_finished_jobs_are_trimmed():
+    queue = JobQueue(max_jobs=2)
+    first = queue.submit(lambda progress: None)
+    wait_for(queue, first, status="done")
+    ids = [queue.submit(lambda progress: None) for _ in range(2)]
+
+    assert queue.get(first) is None
+    assert all(queue.get(job_id) for job_id in ids)
+
+
+def test_jobs_left_by_a_stopped_worker_are_failed_on_startup(workdir):
+    import sqlite3
+
+    path = str(workdir / "jobs.db")
+    JobQueue(path=path)
+    stale = time.time() - 3600
+    with sqlite3.connect(path) as conn:
+        for job_id, status in (("running", "running"), ("queued", "queued")):
+            conn.execute(
+                "INSERT INTO jobs (job_id, name, status, progress, result, created_at, updated_at, heartbeat) "
+                "VALUES (?, 'a.pdf', ?, '{}', 'null', ?, ?, ?)",
+                (job_id, status, stale, stale, stale),
+            )
+
+    restarted = JobQueue(path=path)
+
+    for job_id in ("running", "queued"):
+        job = restarted.get(job_id)
+        assert job["status"] == "failed" and "Interrupted" in job["error"]
+
+
+def test_jobs_of_a_live_worker_are_kept_running(workdir):
+    path = str(workdir / "jobs.db")
+    running = JobQueue(path=path, heartbeat_interval=0.05)
+    release = threading.Event()
+    job_id = running.submit(lambda progress: release.wait(5))
+    wait_for(running, job_id, status="running")
+    time.sleep(0.3)  # Several heartbeat intervals without a progress update
+
+    other = JobQueue(path=path, heartbeat_interval=0.05)
+
+    assert other.get(job_id)["status"] == "running"
+    release.set()
+    wait_for(other, job_id, status="done")
@@ -0,0 +1,120 @@
+import threading
+import time
+import openai
+import pytest
+from openai_client import ModelLimiter, OpenAIClient, SingleFlight
+
+
+def test_single_flight_runs_concurrent_identical_calls_once():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(None)
+        release.wait(5)
+        return object()
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert flight.do("key", lambda: "again") == "again"  # Finished calls are not reused
+
+
+def test_single_flight_hands_the_error_to_every_caller():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+
+
+def acquire_in_thread(limiter, lane):
+    acquired = threading.Event()
+    threading.Thread(target=lambda: (limiter.acquire(lane), acquired.set()), daemon=True).start()
+    return acquired
+
+
+def test_limiter_keeps_slots_free_for_chat():
+    limiter = ModelLimiter(max_concurrency=2, interactive_reserve=0.5)
+    limiter.acquire("ingest")
+
+    second_ingest = acquire_in_thread(limiter, "ingest")
+    assert not second_ingest.wait(0.2)  # The remaining slot is reserved for chat
+    assert acquire_in_thread(limiter, "chat").wait(1)
+
+    limiter.release("ingest")
+    assert second_ingest.wait(1)
+
+
+def test_limiter_lets_waiting_chat_go_first():
+    limiter = ModelLimiter(max_concurrency=1, interactive_reserve=0)
+    limiter.acquire("chat")
+    order = []
+    ingest = threading.Thread(target=lambda: (limiter.acquire("ingest"), order.append("ingest"), limiter.release("ingest")))
+    chat = threading.Thread(target=lambda: (limiter.acquire("chat"), order.append("chat"), limiter.release("chat")))
+    ingest.start()
+    time.sleep(0.1)
+    chat.start()
+    time.sleep(0.1)
+
+    limiter.release("chat")
+    ingest.join(2)
+    chat.join(2)
+
+    assert order == ["chat", "ingest"]
+
+
+def test_limiter_token_bucket_delays_requests_beyond_the_rate():
+    limiter = ModelLimiter(max_concurrency=4, tokens_per_minute=600, interactive_reserve=0)
+    limiter.acquire("chat", tokens=600)
+    limiter.release("chat")
+
+    start = time.monotonic()
+    limiter.acquire("chat", tokens=5)  # The bucket refills at 10 tokens a second
+
+    assert 0.3 < time.monotonic() - start < 2
+
+
+def test_client_retries_rate_limited_requests(monkeypatch):
+    client = OpenAIClient(max_concurrency=2, max_retries=3)
+    monkeypatch.setattr(client, "backoff", lambda attempt, error: 0.01)
+    attempts = []
+
+    def request():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise openai.error.RateLimitError("slow down")
+        return "ok"
+
+    assert client.call("model", "chat", 10, request) == "ok"
+    assert len(attempts) == 3
+
+    with pytest.raises(ValueError):
+        client.call("model", "other", 10, request)
@@ -0,0 +1,22 @@
+from conftest import pages_about
+
+
+def test_one_bad_question_only_fails_itself(make_indexer, credentials, monkeypatch):
+    from qna import ChatBot
+
+    assert make_indexer().add_document("a.pdf", pages_about("alpha", "beta")) == "done"
+    bot = ChatBot(*credentials, "fake-chat", "fake-embedding")
+    embed = bot.search.embedder.embed
+
+    def strict_embed(texts, **options):
+        if "" in texts:
+            raise ValueError("input must not be empty")
+        return embed(texts, **options)
+
+    monkeypatch.setattr(bot.search.embedder, "embed", strict_embed)
+
+    results = bot.get_bot_responses(["alpha0 alpha1", "", "beta0 beta1"])
+
+    assert [result["question"] for result in results] == ["alpha0 alpha1", "", "beta0 beta1"]
+    assert "message" in results[0] and "message" in results[2]
+    assert results[1]["error"] == "input must not be empty"
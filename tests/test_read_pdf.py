@@ -0,0 +1,61 @@
+import io
+from conftest import make_pdf
+from read_pdf import PDFReader
+
+
+def test_extract_text_from_pdf(workdir):
+    path = make_pdf(workdir / "one.pdf", ["Hello from page one"])
+
+    text, message = PDFReader().extract_text_from_pdf(io.BytesIO(path.read_bytes()))
+
+    assert message == "done"
+    assert len(text) == 1
+    assert "Hello from page one" in text[0]
+
+
+def test_extract_text_from_pdf_in_parallel(workdir):
+    pages = [f"page {i} body" for i in range(1, 41)]
+    path = make_pdf(workdir / "long.pdf", pages)
+
+    text, message = PDFReader(workers=2, pages_per_task=4).extract_text_from_pdf(io.BytesIO(path.read_bytes()))
+
+    assert message == "done"
+    assert [page.strip() for page in text] == pages
+
+
+def test_extract_text_from_invalid_pdf():
+    text, message = PDFReader().extract_text_from_pdf(io.BytesIO(b"not a pdf"))
+
+    assert (text, message) == ([], "fail")
+
+
+def test_iter_file_pages_resumes_from_first_page(workdir):
+    path = make_pdf(workdir / "long.pdf", [f"page {i}" for i in range(1, 41)])
+
+    pages = list(PDFReader(workers=2, pages_per_task=4).iter_file_pages(str(path), first_page=35))
+
+    assert [page_num for page_num, _ in pages] == list(range(35, 41))
+    assert pages[0][1].strip() == "page 35"
+
+
+def test_spawned_workers_do_not_rebuild_the_app(workdir):
+    import os
+    import subprocess
+    import sys
+    from conftest import ROOT
+
+    path = make_pdf(workdir / "long.pdf", [f"page {i}" for i in range(1, 41)])
+    # As under `python app.py`: spawned workers re-import the main module before extracting
+    script = (
+        "import sys, app\n"
+        "sys.modules['__main__'] = app\n"
+        "from read_pdf import PDFReader\n"
+        f"print(len(list(PDFReader(workers=2, pages_per_task=4).iter_file_pages({str(path)!r}))))\n"
+    )
+
+    result = subprocess.run([sys.executable, "-c", script], cwd=workdir, env={**os.environ, "PYTHONPATH": ROOT},
+                            capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == "40"
+    assert sorted(p.name for p in workdir.iterdir()) == ["long.pdf"]  # No chunk store, caches or registry
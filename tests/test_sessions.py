@@ -0,0 +1,56 @@
+from sessions import SessionStore
+
+
+def test_sessions_are_shared_through_the_file(workdir):
+    path = str(workdir / "sessions.db")
+    first, second = SessionStore(path=path), SessionStore(path=path)
+
+    first.append("s1", "What is alpha?", "Alpha is the first letter.")
+    second.append("s1", "And beta?", "The second.")
+
+    assert [message["content"] for message in first.get("s1")] == [
+        "What is alpha?", "Alpha is the first letter.", "And beta?", "The second.",
+    ]
+    second.clear("s1")
+    assert first.get("s1") == []
+
+
+def test_history_is_trimmed_by_whole_turns():
+    sessions = SessionStore(history_token_budget=12)
+    sessions.append("s1", "one two three", "four five six")
+    sessions.append("s1", "seven eight nine", "ten eleven twelve")
+
+    assert [message["content"] for message in sessions.get("s1")] == ["seven eight nine", "ten eleven twelve"]
+
+
+def test_least_recently_used_sessions_are_evicted():
+    sessions = SessionStore(max_sessions=2)
+    for session_id in ("s1", "s2", "s3"):
+        sessions.append(session_id, "question", "answer")
+
+    assert len(sessions) == 2
+    assert sessions.get("s1") == []
+
+
+def test_idle_sessions_expire():
+    sessions = SessionStore(idle_ttl=-1)
+    sessions.append("s1", "question", "answer")
+
+    assert sessions.get("s1") == []
+
+
+def test_reading_a_session_does_not_wait_for_writers(workdir):
+    import sqlite3
+    import time
+
+    path = str(workdir / "sessions.db")
+    sessions = SessionStore(path=path)
+    sessions.append("s1", "question", "answer")
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")  # As an upload committing a batch
+    try:
+        started = time.monotonic()
+        assert len(sessions.get("s1")) == 2
+        assert time.monotonic() - started < 1
+    finally:
+        writer.execute("ROLLBACK")
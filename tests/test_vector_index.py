@@ -0,0 +1,27 @@
+import faiss
+import numpy as np
+import pytest
+from vector_index import build_index, normalize_rows, read_index_shared
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "ivf_sq8"])
+def test_read_index_shared_maps_every_index_type(index_type, workdir, monkeypatch, capsys):
+    vectors = normalize_rows(np.random.default_rng(0).normal(size=(200, 16)))
+    index = build_index(index_type, 16, vectors)
+    index.add_with_ids(vectors, np.arange(200, dtype=np.int64))
+    faiss.write_index(index, "index")
+
+    read = faiss.read_index
+    opened = []
+
+    def read_index(path, flags=0):
+        result = read(path, flags)
+        opened.append(flags)
+        return result
+
+    monkeypatch.setattr(faiss, "read_index", read_index)
+    shared = read_index_shared("index")
+
+    assert opened and opened[-1] & faiss.IO_FLAG_MMAP
+    assert "Warning" not in capsys.readouterr().out
+    assert shared.search(vectors[:5], 1)[1][:, 0].tolist() == list(range(5))
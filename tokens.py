@@ -0,0 +1,21 @@
+import math
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")  # Tokenizer used by the OpenAI embedding and chat models
+except Exception:
+    # tiktoken missing, or its vocabulary cannot be downloaded; fall back to an estimate
+    _encoding = None
+
+
+def count_tokens(text):
+    """
+    Return the number of model tokens in `text`.
+
+    Uses tiktoken when available, otherwise estimates about four characters per token.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return sum(max(1, math.ceil(len(word) / 4)) for word in text.split())
@@ -0,0 +1,319 @@
+import math
+import os
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivf_flat", "ivf_pq", "ivf_sq8")
+IVF_TYPES = ("ivf_flat", "ivf_pq", "ivf_sq8")
+REDUCTIONS = ("pca", "truncate")
+
+# Corpus sizes at which "auto" moves to the next index type
+AUTO_IVF_THRESHOLD = 20000
+AUTO_SQ8_THRESHOLD = 500000
+
+POINTS_PER_CENTROID = 39  # Minimum training points per centroid recommended by FAISS
+PQ_CENTROIDS = 256  # 8-bit product quantizer codebooks
+MAX_TRAINING_POINTS = 256 * 1024
+PCA_POINTS_PER_DIM = 4  # Vectors needed per output dimension before a PCA reduction is trained
+
+
+def nlist_for(n):
+    """
+    Number of IVF lists for a corpus of `n` vectors (about 4 * sqrt(n)), capped so
+    every centroid gets enough training points.
+    """
+    return max(1, min(int(4 * math.sqrt(n)), n // POINTS_PER_CENTROID))
+
+
+def min_training_size(index_type):
+    """
+    Number of vectors needed before an index of this type can be trained.
+    """
+    if index_type == "ivf_pq":
+        return PQ_CENTROIDS * POINTS_PER_CENTROID
+    if index_type in IVF_TYPES:
+        return 2 * POINTS_PER_CENTROID
+    return 0
+
+
+def resolve_type(index_type, n):
+    """
+    Return the concrete index type to use for a corpus of `n` vectors.
+
+    "auto" picks by corpus size, and trainable types fall back to an exact flat
+    index until enough vectors exist to train them.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    if index_type == "auto":
+        if n >= AUTO_SQ8_THRESHOLD:
+            index_type = "ivf_sq8"
+        elif n >= AUTO_IVF_THRESHOLD:
+            index_type = "ivf_flat"
+        else:
+            index_type = "flat"
+    if n < min_training_size(index_type):
+        return "flat"
+    return index_type
+
+
+def resolve_reduction(dim, reduced_dim, reduction, n):
+    """
+    Return the dimension the index should search `dim`-dimensional vectors in for a corpus of `n` vectors, 0 meaning full.
+
+    A PCA reduction needs training, so the index keeps full vectors until
+    there are `PCA_POINTS_PER_DIM` vectors per output dimension.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction {reduction!r}, expected one of {REDUCTIONS}")
+    if not reduced_dim or reduced_dim >= dim:
+        return 0
+    if reduction == "pca" and n < PCA_POINTS_PER_DIM * reduced_dim:
+        return 0
+    return reduced_dim
+
+
+def index_reduction(index):
+    """
+    Return (reduction, dimension) of the first-pass reduction built into `index`, or None if it searches full vectors.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if not isinstance(index, faiss.IndexPreTransform):
+        return None
+    first = faiss.downcast_VectorTransform(index.chain.at(0))
+    return ("pca" if isinstance(first, faiss.PCAMatrix) else "truncate"), index.index.d
+
+
+def is_exact(index):
+    """
+    Check whether `index` scores every vector exactly at full dimension, so its results need no re-ranking.
+    """
+    return index_kind(index) == "flat" and index_reduction(index) is None
+
+
+def normalize_rows(vectors):
+    """
+    Return `vectors` as a float32 matrix scaled to unit length, so inner product is cosine similarity.
+    """
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def pq_subquantizers(dim):
+    """
+    Largest number of PQ sub-quantizers (at most dim / 16) that divides `dim`.
+    """
+    m = max(1, dim // 16)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def base_index(index):
+    """
+    Strip id-mapping and pre-transform wrappers and return the underlying index.
+    """
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def index_kind(index):
+    """
+    Return the index type name of an existing FAISS index, or None if it is not one this module builds.
+    """
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    return None
+
+
+def build_index(index_type, dim, training_vectors=None, metric=faiss.METRIC_INNER_PRODUCT, hnsw_m=32, reduced_dim=0, reduction="pca"):
+    """
+    Create an empty FAISS index of the given concrete type, trained on `training_vectors` when it needs training.
+
+    The index is wrapped in an IndexIDMap2, so vectors are added with explicit
+    (chunk) ids that stay stable across deletes and rebuilds. Vectors are
+    expected unit length, so the default inner-product metric ranks by cosine similarity.
+
+    - **reduced_dim**: When set, vectors are projected to this many dimensions
+      before they are stored and searched, and re-normalized. "pca" projects onto
+      the principal components of `training_vectors`; "truncate" keeps the leading
+      dimensions, for models trained so their prefixes are embeddings too
+      (e.g. text-embedding-3). The projection is saved in the index file, and
+      the index still takes and is queried with full `dim`-dimensional vectors.
+    """
+    if not reduced_dim:
+        return faiss.IndexIDMap2(build_base_index(index_type, dim, training_vectors, metric, hnsw_m))
+    reducer = build_reduction(reduction, dim, reduced_dim, training_vectors)
+    normalize = faiss.NormalizationTransform(reduced_dim)
+    reduced_vectors = None
+    if training_vectors is not None:
+        reduced_vectors = normalize.apply(reducer.apply(np.ascontiguousarray(training_vectors, dtype=np.float32)))
+    indexer = faiss.IndexPreTransform(normalize, build_base_index(index_type, reduced_dim, reduced_vectors, metric, hnsw_m))
+    indexer.prepend_transform(reducer)
+    return faiss.IndexIDMap2(indexer)
+
+
+def build_reduction(reduction, dim, reduced_dim, training_vectors=None):
+    """
+    Create the `reduction` ("pca" or "truncate") transform from `dim` to `reduced_dim` dimensions.
+    """
+    if reduction == "truncate":
+        reducer = faiss.LinearTransform(dim, reduced_dim, False)
+        faiss.copy_array_to_vector(np.eye(reduced_dim, dim, dtype=np.float32).ravel(), reducer.A)
+        reducer.is_trained = True
+        return reducer
+    if reduction != "pca":
+        raise ValueError(f"Unknown reduction {reduction!r}, expected one of {REDUCTIONS}")
+    reducer = faiss.PCAMatrix(dim, reduced_dim)
+    n = len(training_vectors)
+    if n > MAX_TRAINING_POINTS:
+        training_vectors = training_vectors[np.sort(np.random.default_rng(0).choice(n, MAX_TRAINING_POINTS, replace=False))]
+    reducer.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+    return reducer
+
+
+def build_base_index(index_type, dim, training_vectors=None, metric=faiss.METRIC_INNER_PRODUCT, hnsw_m=32):
+    if index_type == "flat":
+        return faiss.IndexFlat(dim, metric)
+    if index_type == "hnsw":
+        return faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+
+    n = len(training_vectors)
+    nlist = nlist_for(n)
+    quantizer = faiss.IndexFlat(dim, metric)
+    if index_type == "ivf_flat":
+        indexer = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+    elif index_type == "ivf_pq":
+        indexer = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_subquantizers(dim), 8, metric)
+    elif index_type == "ivf_sq8":
+        indexer = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit, metric)
+    else:
+        raise ValueError(f"Cannot build index of type {index_type!r}")
+
+    if n > MAX_TRAINING_POINTS:
+        sample = np.random.default_rng(0).choice(n, MAX_TRAINING_POINTS, replace=False)
+        training_vectors = training_vectors[np.sort(sample)]
+    indexer.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+    return indexer
+
+
+def needs_rebuild(index, index_type, reduced_dim=0, reduction="pca"):
+    """
+    Check whether `index` should be rebuilt for its current size and settings.
+
+    True when the index has no id map (built before ids were explicit) or uses
+    L2 distance (built before vectors were normalized), when the configured (or
+    size-selected) type or first-pass reduction differs from the built one, or
+    when an IVF index has grown enough that its list count should double.
+    """
+    if not is_id_mapped(index) or index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        return True
+    n = index.ntotal
+    target = resolve_type(index_type, n)
+    if index_kind(index) != target:
+        return True
+    target_dim = resolve_reduction(index.d, reduced_dim, reduction, n)
+    if index_reduction(index) != ((reduction, target_dim) if target_dim else None):
+        return True
+    if target in IVF_TYPES:
+        return nlist_for(n) >= 2 * base_index(index).nlist
+    return False
+
+
+def is_id_mapped(index):
+    """
+    Check whether `index` stores explicit ids through an IndexIDMap2.
+    """
+    return isinstance(faiss.downcast_index(index), faiss.IndexIDMap2)
+
+
+def reconstruct_all(index):
+    """
+    Return (ids, vectors) for every vector stored in `index`.
+
+    Indexes without an id map use vector positions as ids.
+    """
+    inner = base_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    vectors = inner.reconstruct_n(0, inner.ntotal)
+    return index_ids(index), vectors
+
+
+def index_ids(index):
+    """
+    Return the ids of every vector stored in `index`, in storage order.
+
+    Indexes without an id map use vector positions as ids.
+    """
+    if is_id_mapped(index):
+        return faiss.vector_to_array(faiss.downcast_index(index).id_map).astype(np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def remove_ids(index, ids):
+    """
+    Remove the vectors stored under `ids` from `index` in place.
+
+    Only flat indexes are changed in place. IndexIDMap2 assumes removal shifts
+    the remaining vectors down, which IVF indexes do not do, so removing from
+    them would leave the id map pointing at the wrong vectors; HNSW cannot remove
+    at all. For those types this returns False, and the caller must rebuild the
+    index without those vectors.
+    """
+    if not isinstance(base_index(index), faiss.IndexFlat):
+        return False
+    index.remove_ids(faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64)))
+    return True
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Apply query-time recall/latency settings: `nprobe` for IVF indexes and `ef_search` for HNSW.
+    """
+    inner = base_index(index)
+    if nprobe and isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(nprobe, inner.nlist)
+    if ef_search and isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+
+
+def read_index_shared(path):
+    """
+    Load the index at `path` read-only and memory-mapped, so processes serving the same file share its pages.
+
+    Flat and HNSW indexes are mapped with `IO_FLAG_MMAP_IFC` (FAISS 1.11 and
+    later), IVF indexes with `IO_FLAG_MMAP`, which rejects the former. Falls back
+    to a private in-memory copy, with a warning, when neither maps the index. The
+    result must never be modified.
+    """
+    for flags in (faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC, faiss.IO_FLAG_MMAP):
+        try:
+            return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    print(f"Warning: cannot memory-map {path}; this process loads a private copy of the index")
+    return faiss.read_index(path)
+
+
+def write_index_atomic(index, path):
+    """
+    Write `index` to a temporary file and swap it into place so readers never see a partial file.
+    """
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)